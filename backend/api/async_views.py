@@ -0,0 +1,139 @@
+from asgiref.sync import sync_to_async
+from django.db import connections, router
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from . import response_cache
+from .catalogue import (ingredient_catalogue, search_ingredients,
+                        tag_catalogue)
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+
+def json_response(data, **headers):
+    response = HttpResponse(
+        JSONRenderer().render(data), content_type='application/json'
+    )
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def async_read_view(sync_view, fast_path):
+    """Асинхронное представление с быстрым путем для GET-запросов.
+
+    Если быстрый путь не вернул ответ, запрос целиком обрабатывает
+    синхронное представление DRF в потоке.
+    """
+    offloaded = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            response = await fast_path(request, *args, **kwargs)
+            if response is not None:
+                return response
+        return await offloaded(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    return view
+
+
+def catalogue_fast_path(catalogue, searchable=False):
+    """Отдает справочник из снимка в памяти без обращения к базе.
+
+    Поиск по названию перебирает названия в Python, поэтому выполняется
+    в пуле потоков цикла событий, а на PostgreSQL, где поиск идет
+    по индексам базы, остается синхронному представлению.
+    """
+    search_in_database = searchable and connections[
+        router.db_for_read(catalogue.model)
+    ].vendor == 'postgresql'
+
+    async def fast_path(request, pk=None):
+        snapshot = await sync_to_async(catalogue.load)()
+        if request.headers.get('If-None-Match') == snapshot.etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = snapshot.etag
+            return response
+        name = request.GET.get('name') if searchable else None
+        if pk is not None:
+            data = snapshot.data_by_id.get(pk)
+            if data is None:
+                return None
+        elif name:
+            if search_in_database:
+                return None
+            data = await sync_to_async(
+                search_ingredients, thread_sensitive=False
+            )(snapshot, name)
+        else:
+            data = snapshot.data
+        return json_response(data, ETag=snapshot.etag)
+
+    return fast_path
+
+
+def is_anonymous(request):
+    return 'HTTP_AUTHORIZATION' not in request.META
+
+
+def cached_recipe_data(request, pk):
+    if pk is None:
+        query = response_cache.normalize_query(request.GET)
+        if query is None:
+            return None
+        key = response_cache.list_key(request, query)
+    else:
+        key = response_cache.detail_key(request, pk)
+    return response_cache.peek_response_data(key)
+
+
+async def recipe_fast_path(request, pk=None):
+    """Отдает анонимному пользователю рецепты из кэша ответов.
+
+    С заголовком X-Cache-Bypass запрос обрабатывает синхронное
+    представление, как и при промахе.
+    """
+    if (not is_anonymous(request)
+            or request.headers.get(response_cache.BYPASS_HEADER)):
+        return None
+    data = await sync_to_async(cached_recipe_data)(request, pk)
+    if data is None:
+        return None
+    return json_response(data, **{'X-Cache': 'HIT'})
+
+
+tag_list = async_read_view(
+    TagViewSet.as_view({'get': 'list'}, basename='tags', detail=False),
+    catalogue_fast_path(tag_catalogue)
+)
+tag_detail = async_read_view(
+    TagViewSet.as_view({'get': 'retrieve'}, basename='tags', detail=True),
+    catalogue_fast_path(tag_catalogue)
+)
+ingredient_list = async_read_view(
+    IngredientViewSet.as_view(
+        {'get': 'list'}, basename='ingredients', detail=False
+    ),
+    catalogue_fast_path(ingredient_catalogue, searchable=True)
+)
+ingredient_detail = async_read_view(
+    IngredientViewSet.as_view(
+        {'get': 'retrieve'}, basename='ingredients', detail=True
+    ),
+    catalogue_fast_path(ingredient_catalogue)
+)
+recipe_list = async_read_view(
+    RecipeViewSet.as_view(
+        {'get': 'list', 'post': 'create'}, basename='recipes', detail=False
+    ),
+    recipe_fast_path
+)
+recipe_detail = async_read_view(
+    RecipeViewSet.as_view(
+        {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+         'delete': 'destroy'},
+        basename='recipes', detail=True
+    ),
+    recipe_fast_path
+)
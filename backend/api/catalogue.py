@@ -0,0 +1,84 @@
+from threading import Lock
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+from recipes.models import Ingredient, Tag
+from recipes.search import IngredientNameIndex
+
+
+class CatalogueSnapshot:
+    """Неизменяемый снимок справочника одной версии."""
+
+    def __init__(self, version, objects, data):
+        self.version = version
+        self.etag = f'"{version}"'
+        self.objects = {obj.pk: obj for obj in objects}
+        self.data = data
+        self.data_by_id = {item['id']: item for item in data}
+
+
+class CatalogueCache:
+    """Кэш справочника в памяти процесса.
+
+    Хранит объекты и сериализованные данные целиком. Версия справочника
+    лежит в общем кэше Django, поэтому изменение в одном воркере gunicorn
+    заставляет остальные перестроить свои копии при следующем запросе.
+    """
+
+    def __init__(self, name, model, serializer_class):
+        self.model = model
+        self.serializer_class = serializer_class
+        self.version_key = f'catalogue:{name}:version'
+        self._snapshot = None
+        self._lock = Lock()
+
+    def get_version(self):
+        return cache.get_or_set(self.version_key, uuid4().hex, None)
+
+    def invalidate(self):
+        cache.set(self.version_key, uuid4().hex, None)
+
+    def build(self, version):
+        # Снимок новой версии читается с основной базы: реплика может
+        # отставать, а устаревшие данные остались бы в кэше до следующей
+        # смены версии.
+        objects = list(self.model.objects.using(DEFAULT_DB_ALIAS))
+        serializer = import_string(self.serializer_class)
+        data = serializer(objects, many=True).data
+        return CatalogueSnapshot(version, objects, data)
+
+    def load(self):
+        version = self.get_version()
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self.build(version)
+            return self._snapshot
+
+
+class IngredientCatalogueCache(CatalogueCache):
+    """Кэш ингредиентов с префиксным индексом названий."""
+
+    def build(self, version):
+        snapshot = super().build(version)
+        snapshot.name_index = IngredientNameIndex(
+            (pk, obj.name) for pk, obj in snapshot.objects.items()
+        )
+        return snapshot
+
+
+def search_ingredients(snapshot, name):
+    """Ищет ингредиенты снимка по названию в индексе, без обращения
+    к базе: сначала совпадения по началу названия."""
+    ids, _ = snapshot.name_index.search(name)
+    return [snapshot.data_by_id[pk] for pk in ids]
+
+
+tag_catalogue = CatalogueCache(
+    'tags', Tag, 'api.serializers.TagSerializer'
+)
+ingredient_catalogue = IngredientCatalogueCache(
+    'ingredients', Ingredient, 'api.serializers.IngredientSerializer'
+)
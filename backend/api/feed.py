@@ -0,0 +1,14 @@
+from recipes.models import FeedItem
+
+
+class Timeline:
+    """Лента подписок пользователя в виде рецептов из queryset."""
+
+    def __init__(self, user, queryset):
+        self.user = user
+        self.queryset = queryset
+
+    def page(self, before, limit):
+        recipe_ids = FeedItem.objects.recipe_ids(self.user, before, limit)
+        recipes = self.queryset.in_bulk(recipe_ids)
+        return [recipes[pk] for pk in recipe_ids if pk in recipes]
@@ -0,0 +1,119 @@
+import binascii
+from base64 import b64decode
+from uuid import uuid4
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image
+from rest_framework import serializers
+
+from recipes.constant import MAX_IMAGE_PIXELS, MAX_IMAGE_SIDE, MAX_IMAGE_SIZE
+
+CHUNK_LENGTH = 4 * 64 * 1024
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def base64_chunks(data, start):
+    """Декодирует base64 кусками по CHUNK_LENGTH символов.
+
+    Пробелы и переводы строк (MIME base64) удаляются, а неполная группа
+    из четырех символов переносится в следующий кусок, чтобы каждый
+    кусок декодировался отдельно.
+    """
+    rest = ''
+    for offset in range(start, len(data), CHUNK_LENGTH):
+        part = rest + ''.join(data[offset:offset + CHUNK_LENGTH].split())
+        end = len(part) - len(part) % 4
+        part, rest = part[:end], part[end:]
+        if part:
+            yield b64decode(part)
+    if rest:
+        raise binascii.Error('Incorrect padding')
+
+
+class StreamingBase64ImageField(serializers.ImageField):
+    """Картинка в base64, декодируемая по частям во временный файл.
+
+    Размер проверяется по длине строки до декодирования, формат по
+    сигнатуре первого куска, а размеры по заголовку файла до того,
+    как Pillow прочитает пиксели.
+    """
+
+    EMPTY_VALUES = (None, '', [], (), {})
+    default_error_messages = {
+        'invalid_base64': 'Загрузите корректное изображение в base64.',
+        'invalid_type': 'Допустимые форматы: jpg, png, gif.',
+        'too_large': (
+            f'Размер изображения больше {MAX_IMAGE_SIZE // 1024 // 1024} МБ!'
+        ),
+        'too_many_pixels': (
+            f'Изображение больше {MAX_IMAGE_SIDE} пикселей по стороне '
+            f'или {MAX_IMAGE_PIXELS} пикселей всего!'
+        ),
+    }
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            self.fail('invalid_base64')
+        start = data.find(';base64,')
+        start = 0 if start == -1 else start + len(';base64,')
+        length = (
+            len(data) - start
+            - data.count('\n', start) - data.count('\r', start)
+        )
+        if length // 4 * 3 > MAX_IMAGE_SIZE:
+            self.fail('too_large')
+        upload = self.decode(data, start)
+        try:
+            self.check_dimensions(upload)
+            return super().to_internal_value(upload)
+        except Exception:
+            upload.close()
+            raise
+
+    def decode(self, data, start):
+        upload = None
+        size = 0
+        try:
+            for chunk in base64_chunks(data, start):
+                if upload is None:
+                    extension = self.sniff(chunk)
+                    upload = TemporaryUploadedFile(
+                        f'{uuid4()}.{extension}',
+                        f'image/{extension.replace("jpg", "jpeg")}',
+                        0, None
+                    )
+                upload.write(chunk)
+                size += len(chunk)
+        except (binascii.Error, ValueError):
+            if upload is not None:
+                upload.close()
+            self.fail('invalid_base64')
+        if upload is None:
+            self.fail('invalid_base64')
+        upload.size = size
+        upload.seek(0)
+        return upload
+
+    def sniff(self, chunk):
+        for signature, extension in SIGNATURES:
+            if chunk.startswith(signature):
+                return extension
+        self.fail('invalid_type')
+
+    def check_dimensions(self, upload):
+        try:
+            with Image.open(upload.temporary_file_path()) as image:
+                width, height = image.size
+        except (OSError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        if (max(width, height) > MAX_IMAGE_SIDE
+                or width * height > MAX_IMAGE_PIXELS):
+            self.fail('too_many_pixels')
+        upload.seek(0)
@@ -1,26 +1,50 @@
-from django_filters.rest_framework import (BooleanFilter, FilterSet,
-                                           ModelChoiceFilter,
-                                           ModelMultipleChoiceFilter, filters)
+from django.db.models import (Case, Exists, IntegerField, OuterRef, Value,
+                              When)
+from django_filters.rest_framework import BooleanFilter, FilterSet, filters
 from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.filters import OrderingFilter
 
-from recipes.models import Ingredient, Recipe, Tag, User
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            TagInRecipe)
+from recipes.search import search_recipes
+
+from .catalogue import tag_catalogue
 
 
 class IngredientSearchFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='icontains')
+    name = filters.CharFilter(method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def filter_name(self, queryset, name, value):
+        """Ищет ингредиенты по подстроке, ставя вперед совпадения
+        по началу названия.
+
+        На SQLite, где LIKE не учитывает регистр кириллицы, поиск
+        выполняет IngredientViewSet по индексу названий в памяти.
+        """
+        return queryset.filter(name__icontains=value).annotate(
+            search_rank=Case(
+                When(name__istartswith=value, then=Value(0)),
+                default=Value(1), output_field=IntegerField()
+            )
+        ).order_by('search_rank', 'name')
+
 
 class RecipeFilter(FilterSet):
-    author = ModelChoiceFilter(queryset=User.objects.all())
-    tags = ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
-    )
+    """Фильтры рецептов.
+
+    Каждый фильтр добавляет к запросу условие EXISTS, поэтому фильтры
+    сочетаются в один запрос, а рецепт с несколькими подходящими тегами
+    не дублируется в выдаче. Поиск по названию, описанию и ингредиентам
+    добавляет релевантность search_rank.
+    """
+
+    author = filters.NumberFilter(field_name='author_id')
+    search = filters.CharFilter(method='filter_search')
+    tags = filters.CharFilter(method='filter_tags')
     is_favorited = BooleanFilter(
         method='get_is_favorited'
     )
@@ -34,34 +58,52 @@ class RecipeFilter(FilterSet):
             'author',
             'is_in_shopping_cart',
             'tags',
-            'is_favorited'
+            'is_favorited',
+            'search'
         )
 
-    def get_is_favorited(self, queryset, name, value):
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_tags(self, queryset, name, value):
+        slugs = set(self.data.getlist(name))
+        tag_ids = [
+            pk for pk, tag in tag_catalogue.load().objects.items()
+            if tag.slug in slugs
+        ]
+        return queryset.filter(Exists(TagInRecipe.objects.filter(
+            tag_id__in=tag_ids, recipe=OuterRef('pk')
+        )))
+
+    def filter_by_user(self, queryset, model, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(favorites__user=user)
+            return queryset.filter(Exists(model.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )))
         if value and not user.is_authenticated:
             raise AuthenticationFailed('Необходимо авторизоваться!')
         return queryset
 
+    def get_is_favorited(self, queryset, name, value):
+        return self.filter_by_user(queryset, Favorite, value)
+
     def get_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        if value and user.is_authenticated:
-            return queryset.filter(shopping_cart__user=user)
-        if value and not user.is_authenticated:
-            raise AuthenticationFailed('Необходимо авторизоваться!')
-        return queryset
+        return self.filter_by_user(queryset, ShoppingCart, value)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """Сортировка рецептов с id в качестве последнего ключа,
+    чтобы страницы не пересекались при равных значениях. При поиске
+    по умолчанию сортирует по релевантности."""
+
+    def get_default_ordering(self, view):
+        if view.request.query_params.get('search'):
+            return ('-search_rank', )
+        return super().get_default_ordering(view)
 
-    def filter_queryset(self, queryset):
-        tags = self.request.GET.getlist('tags')
-        if not tags:
-            return queryset
-        existing_tags = Tag.objects.filter(slug__in=tags)
-        if existing_tags:
-            filtered_queryset = queryset.filter(tags__in=existing_tags)
-            if not filtered_queryset:
-                return queryset
-            return filtered_queryset
-        else:
-            return queryset
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view))
+        if '-id' not in ordering and 'id' not in ordering:
+            ordering.append('-id')
+        return ordering
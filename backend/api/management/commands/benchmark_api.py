@@ -0,0 +1,242 @@
+import itertools
+import json
+import re
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+
+class InProcessClient:
+    """Запросы через тестовый клиент DRF с подсчётом SQL-запросов."""
+
+    def __init__(self, user):
+        self.user = user
+
+    def get(self, path, authenticated):
+        client = APIClient(HTTP_HOST=settings.ALLOWED_HOSTS[0].replace(
+            '*', 'localhost'
+        ))
+        if authenticated:
+            client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        connection.close()
+        return response.status_code, len(context.captured_queries)
+
+
+class HttpClient:
+    """Запросы к запущенному серверу; число SQL-запросов берётся
+    из заголовка Server-Timing, если запрос попал в выборку метрик."""
+
+    def __init__(self, user, url):
+        self.url = url.rstrip('/')
+        self.token = Token.objects.get_or_create(user=user)[0].key
+
+    def get(self, path, authenticated):
+        headers = {}
+        if authenticated:
+            headers['Authorization'] = f'Token {self.token}'
+        try:
+            with urlopen(Request(self.url + path, headers=headers)) as resp:
+                resp.read()
+                status, timing = resp.status, resp.headers['Server-Timing']
+        except HTTPError as error:
+            status, timing = error.code, None
+        match = SERVER_TIMING_QUERIES.search(timing or '')
+        return status, int(match.group(1)) if match else None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the API hot paths and compare the results '
+            'with a stored baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Адрес запущенного сервера, по умолчанию тестовый клиент'
+        )
+        parser.add_argument('--email', help='Пользователь для запросов')
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--only', help='Подстрока в имени сценария')
+        parser.add_argument('--save', help='Сохранить результат в JSON')
+        parser.add_argument('--compare', help='JSON с базовым результатом')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Допустимый рост p95 относительно базового результата'
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['email'])
+        if options['url']:
+            client = HttpClient(user, options['url'])
+        else:
+            client = InProcessClient(user)
+        results = {}
+        for name, path, authenticated in self.get_scenarios(user):
+            if options['only'] and options['only'] not in name:
+                continue
+            results[name] = self.run(
+                client, path, authenticated, options['requests'],
+                options['warmup'], options['concurrency']
+            )
+            self.report(name, results[name])
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'mode': 'http' if options['url'] else 'in-process',
+                    'vendor': connection.vendor,
+                    'recipes': Recipe.objects.count(),
+                    'scenarios': results,
+                }, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(results, options['compare'], options['tolerance'])
+
+    def get_user(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+        else:
+            user = User.objects.filter(
+                shoppingcart__isnull=False
+            ).order_by('id').first()
+        if user is None:
+            raise CommandError(
+                'Нет пользователя со списком покупок, '
+                'запустите generate_fake_data.'
+            )
+        return user
+
+    def get_scenarios(self, user):
+        slugs = list(Tag.objects.order_by('id').values_list(
+            'slug', flat=True
+        )[:2])
+        author_id = Recipe.objects.order_by('-id').values_list(
+            'author_id', flat=True
+        ).first()
+        filters = (
+            ('tags', [('tags', slug) for slug in slugs]),
+            ('author', [('author', author_id)]),
+            ('is_favorited', [('is_favorited', 1)]),
+            ('is_in_shopping_cart', [('is_in_shopping_cart', 1)]),
+        )
+        yield 'recipes anonymous', '/api/recipes/', False
+        for size in range(len(filters) + 1):
+            for combination in itertools.combinations(filters, size):
+                labels = [label for label, _ in combination]
+                params = [pair for _, pairs in combination for pair in pairs]
+                yield (
+                    'recipes?' + '&'.join(labels),
+                    '/api/recipes/?' + urlencode(params),
+                    True
+                )
+        yield (
+            'subscriptions',
+            '/api/users/subscriptions/?recipes_limit=3',
+            True
+        )
+        name = Ingredient.objects.order_by('id').values_list(
+            'name', flat=True
+        ).first() or ''
+        for length in (1, 3):
+            yield (
+                f'ingredients?name[{length}]',
+                '/api/ingredients/?' + urlencode({'name': name[:length]}),
+                False
+            )
+        yield 'shopping_cart', '/api/recipes/shopping_cart/', True
+        for export_format in ('txt', 'csv'):
+            yield (
+                f'download_shopping_cart.{export_format}',
+                '/api/recipes/download_shopping_cart/?format='
+                + export_format,
+                True
+            )
+
+    def run(self, client, path, authenticated, requests, warmup,
+            concurrency):
+        for _ in range(warmup):
+            client.get(path, authenticated)
+
+        def timed(_):
+            started = perf_counter()
+            status, queries = client.get(path, authenticated)
+            return (perf_counter() - started) * 1000, status, queries
+
+        started = perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            samples = list(executor.map(timed, range(requests)))
+        elapsed = perf_counter() - started
+        timings = [timing for timing, _, _ in samples]
+        queries = [count for _, _, count in samples if count is not None]
+        return {
+            'path': path,
+            'rps': round(requests / elapsed, 1),
+            'p50': round(percentile(timings, 50), 2),
+            'p95': round(percentile(timings, 95), 2),
+            'p99': round(percentile(timings, 99), 2),
+            'queries': max(queries) if queries else None,
+            'errors': sum(status >= 400 for _, status, _ in samples),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:>45}: {result["rps"]:>7} req/s '
+            f'p50={result["p50"]:.1f} ms p95={result["p95"]:.1f} ms '
+            f'p99={result["p99"]:.1f} ms queries={result["queries"]} '
+            f'errors={result["errors"]}'
+        )
+
+    def compare(self, results, path, tolerance):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)['scenarios']
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            if result['errors'] > base['errors']:
+                regressions.append(f'{name}: ошибок {result["errors"]}')
+            if result['p95'] > base['p95'] * (1 + tolerance):
+                regressions.append(
+                    f'{name}: p95 {base["p95"]} -> {result["p95"]} ms'
+                )
+            if (None not in (result['queries'], base['queries'])
+                    and result['queries'] > base['queries']):
+                regressions.append(
+                    f'{name}: запросов {base["queries"]} -> '
+                    f'{result["queries"]}'
+                )
+        if regressions:
+            raise CommandError(
+                'Регрессия относительно базового результата:\n'
+                + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Регрессий относительно базового результата нет.'
+        ))
@@ -0,0 +1,147 @@
+import random
+import statistics
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import FeedItem, Recipe
+from users.models import Subscribe
+
+User = get_user_model()
+
+BATCH_SIZE = 10_000
+PAGE_SIZE = 6
+
+
+class Rollback(Exception):
+    pass
+
+
+def join_recipe_ids(user, before, limit):
+    """Прежний способ: рецепты авторов через соединение с подписками."""
+    recipes = Recipe.objects.filter(author__following__user=user)
+    if before is not None:
+        recipes = recipes.filter(pk__lt=before)
+    return list(recipes.order_by('-id').values_list('id', flat=True)[:limit])
+
+
+class Command(BaseCommand):
+    help = ('Compare the subscription feed timelines with the join-based '
+            'query on a synthetic dataset')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--authors', type=int, default=2000)
+        parser.add_argument('--subscriptions', type=int, default=10)
+        parser.add_argument('--heavy-users', type=int, default=500)
+        parser.add_argument('--heavy-subscriptions', type=int, default=300)
+        parser.add_argument('--recipes', type=int, default=60_000)
+        parser.add_argument('--pages', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                groups = self.create_dataset(options)
+                for label, user_ids in groups:
+                    if not user_ids:
+                        continue
+                    self.stdout.write(label)
+                    self.run(user_ids, options['pages'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_dataset(self, options):
+        started = perf_counter()
+        for start in range(0, options['users'], BATCH_SIZE):
+            User.objects.bulk_create(
+                User(
+                    username=f'feed_{i}',
+                    email=f'feed_{i}@example.com',
+                    first_name='feed',
+                    last_name='feed',
+                ) for i in range(
+                    start, min(start + BATCH_SIZE, options['users'])
+                )
+            )
+        user_ids = list(User.objects.filter(
+            username__startswith='feed_'
+        ).order_by('id').values_list('id', flat=True))
+        # Популярность авторов по закону Ципфа: у первых авторов
+        # подписчиков больше FEED_FANOUT_LIMIT, у остальных — единицы.
+        # Последние heavy_users подписаны на heavy_subscriptions случайных
+        # авторов: для них соединение сортирует больше всего рецептов.
+        author_ids = user_ids[:options['authors']]
+        weights = [1 / rank for rank in range(1, len(author_ids) + 1)]
+        heavy_ids = user_ids[len(user_ids) - options['heavy_users']:]
+        regular_ids = user_ids[:len(user_ids) - len(heavy_ids)]
+        heavy = set(heavy_ids)
+        subscriptions = []
+        for user_id in user_ids:
+            if user_id in heavy:
+                authors = set(random.sample(
+                    author_ids, options['heavy_subscriptions']
+                ))
+            else:
+                authors = set(random.choices(
+                    author_ids, weights, k=options['subscriptions']
+                ))
+            authors.discard(user_id)
+            subscriptions.extend(
+                Subscribe(user_id=user_id, author_id=author_id)
+                for author_id in authors
+            )
+        Subscribe.objects.bulk_create(subscriptions, batch_size=BATCH_SIZE)
+        for start in range(0, options['recipes'], BATCH_SIZE):
+            Recipe.objects.bulk_create(
+                Recipe(
+                    name=f'feed {start + i}',
+                    text='feed',
+                    cooking_time=1,
+                    image='recipes/images/bench.png',
+                    author_id=random.choice(author_ids),
+                ) for i in range(
+                    min(BATCH_SIZE, options['recipes'] - start)
+                )
+            )
+        call_command('rebuild_feeds', batch_size=5000, stdout=self.stdout)
+        self.stdout.write(
+            f'Подписок: {len(subscriptions)}, строк лент: '
+            f'{FeedItem.objects.count()}, подготовка заняла '
+            f'{perf_counter() - started:.0f} с'
+        )
+        return (
+            ('Обычные пользователи', regular_ids),
+            ('Много подписок', heavy_ids),
+        )
+
+    def run(self, user_ids, pages, repeat):
+        users = User.objects.filter(
+            pk__in=random.sample(user_ids, min(repeat, len(user_ids)))
+        )
+        cases = (
+            ('join', join_recipe_ids),
+            ('timeline', FeedItem.objects.recipe_ids),
+        )
+        for label, recipe_ids in cases:
+            timings = []
+            for user in users:
+                before = None
+                for _ in range(pages):
+                    started = perf_counter()
+                    page = recipe_ids(user, before, PAGE_SIZE + 1)
+                    timings.append((perf_counter() - started) * 1000)
+                    if len(page) <= PAGE_SIZE:
+                        break
+                    before = page[PAGE_SIZE - 1]
+            percentiles = statistics.quantiles(timings, n=100)
+            self.stdout.write(
+                f'{label:>10}: страница p50={percentiles[49]:.2f} ms '
+                f'p95={percentiles[94]:.2f} ms p99={percentiles[98]:.2f} ms'
+            )
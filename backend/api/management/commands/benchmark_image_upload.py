@@ -0,0 +1,73 @@
+import base64
+import multiprocessing
+import os
+import resource
+from io import BytesIO
+from time import perf_counter
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from PIL import Image
+from rest_framework import serializers
+
+from api.fields import StreamingBase64ImageField
+
+
+def old_to_internal_value(data):
+    """Прежнее декодирование Base64ImageField для сравнения."""
+    header, data = data.split(';base64,')
+    decoded = base64.b64decode(data)
+    Image.open(BytesIO(decoded)).format
+    return serializers.ImageField().to_internal_value(
+        ContentFile(decoded, name='image.jpg')
+    )
+
+
+def new_to_internal_value(data):
+    return StreamingBase64ImageField().to_internal_value(data)
+
+
+def measure(decoder, payload, queue):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = perf_counter()
+    decoder(payload)
+    elapsed = perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(((after - before) / 1024, elapsed * 1000))
+
+
+class Command(BaseCommand):
+    help = ('Compare peak RSS of the old and the streaming base64 '
+            'image decoding')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=2000)
+        parser.add_argument('--height', type=int, default=1500)
+
+    def handle(self, *args, **options):
+        size = (options['width'], options['height'])
+        buffer = BytesIO()
+        Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(
+            buffer, 'JPEG', quality=85
+        )
+        payload = 'data:image/jpeg;base64,' + base64.b64encode(
+            buffer.getvalue()
+        ).decode()
+        self.stdout.write(
+            f'Картинка {size[0]}x{size[1]}, '
+            f'{len(buffer.getvalue()) / 1024 / 1024:.1f} МБ, '
+            f'base64 {len(payload) / 1024 / 1024:.1f} МБ'
+        )
+        context = multiprocessing.get_context('fork')
+        for label, decoder in (('old', old_to_internal_value),
+                               ('streaming', new_to_internal_value)):
+            queue = context.Queue()
+            process = context.Process(
+                target=measure, args=(decoder, payload, queue)
+            )
+            process.start()
+            peak, elapsed = queue.get()
+            process.join()
+            self.stdout.write(
+                f'{label:>10}: пик RSS +{peak:.1f} МБ, {elapsed:.1f} ms'
+            )
@@ -0,0 +1,79 @@
+import csv
+import random
+import statistics
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.filters import IngredientSearchFilter
+from recipes.models import Ingredient
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare latency of the old icontains ingredient filter '
+            'and the ranked search on a synthetic catalogue')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                names = self.create_catalogue(options['size'])
+                self.run(names, options['queries'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_catalogue(self, size):
+        with open(
+            f'{settings.BASE_DIR}/data/ingredients.csv',
+            'r',
+            encoding='utf-8'
+        ) as csv_file:
+            base = [row[0] for row in csv.reader(csv_file)]
+        names = [f'{base[i % len(base)]} {i}' for i in range(size)]
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit='г') for name in names),
+            batch_size=5000
+        )
+        self.stdout.write(f'Создано ингредиентов: {size}')
+        return names
+
+    def run(self, names, count):
+        queries = []
+        for _ in range(count):
+            name = random.choice(names)
+            length = random.randint(1, 5)
+            start = random.choice((0, random.randint(0, len(name) - 1)))
+            queries.append(name[start:start + length])
+
+        def old(query):
+            return list(Ingredient.objects.filter(name__icontains=query))
+
+        def new(query):
+            return list(IngredientSearchFilter(
+                {'name': query}, queryset=Ingredient.objects.all()
+            ).qs)
+
+        for label, search in (('icontains', old), ('ranked', new)):
+            search(queries[0])
+            timings = []
+            for query in queries:
+                started = perf_counter()
+                search(query)
+                timings.append((perf_counter() - started) * 1000)
+            percentiles = statistics.quantiles(timings, n=100)
+            self.stdout.write(
+                f'{label:>10}: p50={percentiles[49]:.2f} ms '
+                f'p99={percentiles[98]:.2f} ms'
+            )
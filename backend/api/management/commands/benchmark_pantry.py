@@ -0,0 +1,80 @@
+import statistics
+from time import perf_counter
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from recipes.search import RecipeIngredientIndex
+
+
+class Command(BaseCommand):
+    help = ('Measure "what can I cook" ranking latency on a synthetic '
+            'in-memory recipe ingredient index')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1_000_000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--per-recipe', type=int, default=10)
+        parser.add_argument('--pantry', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=6)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        # Популярность ингредиентов по закону Ципфа: соль и лук
+        # встречаются в большой доле рецептов, экзотика — в единицах.
+        weights = 1 / np.arange(1, options['ingredients'] + 1)
+        weights /= weights.sum()
+        sizes = rng.integers(
+            max(1, options['per_recipe'] // 2),
+            options['per_recipe'] * 3 // 2 + 1,
+            options['recipes']
+        )
+        recipe_ids = np.repeat(
+            np.arange(1, options['recipes'] + 1, dtype=np.int32), sizes
+        )
+        ingredient_ids = rng.choice(
+            options['ingredients'], len(recipe_ids), p=weights
+        ).astype(np.int32) + 1
+        pairs = np.unique(np.stack((recipe_ids, ingredient_ids)), axis=1)
+
+        started = perf_counter()
+        index = RecipeIngredientIndex(pairs[0], pairs[1])
+        self.stdout.write(
+            f'Индекс: {options["recipes"]} рецептов, {pairs.shape[1]} пар, '
+            f'построен за {perf_counter() - started:.1f} с'
+        )
+
+        pantries = [
+            rng.choice(
+                options['ingredients'], options['pantry'], replace=False,
+                p=weights
+            ) + 1
+            for _ in range(options['queries'])
+        ]
+        page_size = options['page_size']
+        timings, matched = [], []
+        for pantry in pantries:
+            started = perf_counter()
+            matches = index.match(pantry.tolist())
+            matches[:page_size]
+            timings.append((perf_counter() - started) * 1000)
+            matched.append(len(matches))
+        percentiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f'Совпадений в среднем: {statistics.mean(matched):.0f}; '
+            f'первая страница: p50={percentiles[49]:.2f} ms '
+            f'p95={percentiles[94]:.2f} ms p99={percentiles[98]:.2f} ms'
+        )
+
+        changed = rng.choice(options['recipes'], 100, replace=False) + 1
+        started = perf_counter()
+        index.update(
+            changed.tolist(), np.repeat(changed.astype(np.int32), 3),
+            rng.integers(1, options['ingredients'] + 1, 300, dtype=np.int32)
+        )
+        self.stdout.write(
+            'Обновление 100 рецептов: '
+            f'{(perf_counter() - started) * 1000:.1f} ms'
+        )
@@ -0,0 +1,149 @@
+import random
+import statistics
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.http import QueryDict
+from django.test import RequestFactory
+
+from api.catalogue import tag_catalogue
+from api.filters import RecipeFilter
+from recipes.models import Favorite, Recipe, Tag, TagInRecipe
+
+User = get_user_model()
+
+BATCH_SIZE = 10_000
+PAGE_SIZE = 6
+
+
+class Rollback(Exception):
+    pass
+
+
+def old_filter_queryset(queryset, slugs):
+    """Прежняя реализация RecipeFilter.filter_queryset для сравнения."""
+    existing_tags = Tag.objects.filter(slug__in=slugs)
+    if existing_tags:
+        filtered_queryset = queryset.filter(tags__in=existing_tags)
+        if not filtered_queryset:
+            return queryset
+        return filtered_queryset
+    return queryset
+
+
+class Command(BaseCommand):
+    help = ('Compare the old and the EXISTS-based recipe filters '
+            'on a synthetic dataset')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1_000_000)
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                user, slugs = self.create_dataset(
+                    options['recipes'], options['authors']
+                )
+                self.run(user, slugs, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            tag_catalogue.invalidate()
+
+    def create_dataset(self, recipes_count, authors_count):
+        User.objects.bulk_create(
+            User(
+                username=f'bench_{i}',
+                email=f'bench_{i}@example.com',
+                first_name='bench',
+                last_name='bench',
+            ) for i in range(authors_count)
+        )
+        author_ids = list(
+            User.objects.filter(username__startswith='bench_')
+            .values_list('id', flat=True)
+        )
+        user = User.objects.get(username='bench_0')
+        slugs = [f'bench_{i}' for i in range(6)]
+        Tag.objects.bulk_create(
+            Tag(name=slug, slug=slug, color=f'#BE{i:04d}')
+            for i, slug in enumerate(slugs)
+        )
+        tag_catalogue.invalidate()
+        tag_ids = list(
+            Tag.objects.filter(slug__in=slugs).values_list('id', flat=True)
+        )
+        for start in range(0, recipes_count, BATCH_SIZE):
+            last_id = Recipe.objects.order_by('-id').values_list(
+                'id', flat=True
+            ).first() or 0
+            size = min(BATCH_SIZE, recipes_count - start)
+            Recipe.objects.bulk_create(
+                Recipe(
+                    name=f'bench {start + i}',
+                    text='bench',
+                    cooking_time=1,
+                    image='recipes/images/bench.png',
+                    author_id=random.choice(author_ids),
+                ) for i in range(size)
+            )
+            ids = Recipe.objects.filter(pk__gt=last_id).values_list(
+                'id', flat=True
+            )
+            TagInRecipe.objects.bulk_create(
+                TagInRecipe(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in ids
+                for tag_id in random.sample(tag_ids, random.randint(1, 2))
+            )
+            Favorite.objects.bulk_create(
+                Favorite(recipe_id=recipe_id, user=user)
+                for recipe_id in ids if random.random() < 0.01
+            )
+        self.stdout.write(f'Создано рецептов: {recipes_count}')
+        return user, slugs[:2]
+
+    def run(self, user, slugs, repeat):
+        request = RequestFactory().get('/api/recipes/')
+        request.user = user
+        base = Recipe.objects.order_by('-id')
+
+        def page(queryset):
+            return queryset.count(), list(queryset[:PAGE_SIZE])
+
+        def new(params):
+            data = QueryDict(mutable=True)
+            for key, value in params.items():
+                data.setlist(key, value)
+            return page(RecipeFilter(
+                data, queryset=base, request=request
+            ).qs)
+
+        cases = (
+            ('old tags', lambda: page(old_filter_queryset(base, slugs))),
+            ('new tags', lambda: new({'tags': slugs})),
+            ('new tags+favorited', lambda: new(
+                {'tags': slugs, 'is_favorited': ['true']}
+            )),
+            ('new tags+author', lambda: new(
+                {'tags': slugs, 'author': [str(user.pk)]}
+            )),
+        )
+        for label, case in cases:
+            case()
+            timings = []
+            for _ in range(repeat):
+                started = perf_counter()
+                case()
+                timings.append((perf_counter() - started) * 1000)
+            percentiles = statistics.quantiles(timings, n=100)
+            self.stdout.write(
+                f'{label:>20}: p50={percentiles[49]:.1f} ms '
+                f'p99={percentiles[98]:.1f} ms'
+            )
@@ -0,0 +1,98 @@
+import asyncio
+import statistics
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+
+class Command(BaseCommand):
+    help = ('Measure throughput of fast clients while many slow clients '
+            'hold connections to a running server')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--path', default='/api/tags/')
+        parser.add_argument('--slow-clients', type=int, default=500)
+        parser.add_argument(
+            '--slow-seconds', type=float, default=10,
+            help='За сколько секунд медленный клиент отправляет запрос'
+        )
+        parser.add_argument('--fast-clients', type=int, default=20)
+        parser.add_argument('--duration', type=float, default=10)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        self.host, self.port = url.hostname, url.port or 80
+        self.request = (
+            f'GET {options["path"]} HTTP/1.1\r\n'
+            f'Host: {url.netloc}\r\nConnection: close\r\n\r\n'
+        ).encode()
+        fast, slow = asyncio.run(self.run(options))
+        self.stdout.write(
+            f'Медленных клиентов: {options["slow_clients"]}, '
+            f'получили ответ: {sum(slow)}'
+        )
+        if not fast:
+            self.stdout.write('Быстрые клиенты не получили ни одного ответа.')
+            return
+        self.stdout.write(
+            f'Быстрые клиенты: {len(fast) / options["duration"]:.1f} req/s, '
+            f'p50={percentile(fast, 50):.1f} ms '
+            f'p95={percentile(fast, 95):.1f} ms '
+            f'p99={percentile(fast, 99):.1f} ms'
+        )
+
+    async def run(self, options):
+        deadline = perf_counter() + options['duration']
+        slow = [
+            asyncio.create_task(self.slow_client(options['slow_seconds']))
+            for _ in range(options['slow_clients'])
+        ]
+        await asyncio.sleep(1)
+        timings = []
+        await asyncio.gather(*(
+            self.fast_client(deadline, timings)
+            for _ in range(options['fast_clients'])
+        ))
+        return timings, await asyncio.gather(*slow)
+
+    async def fetch(self, delay=0):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            if delay:
+                for byte in range(len(self.request)):
+                    writer.write(self.request[byte:byte + 1])
+                    await writer.drain()
+                    await asyncio.sleep(delay)
+            else:
+                writer.write(self.request)
+            status = await reader.readline()
+            await reader.read()
+            return status.split()[1] == b'200'
+        finally:
+            writer.close()
+
+    async def slow_client(self, seconds):
+        try:
+            return await self.fetch(seconds / len(self.request))
+        except (OSError, IndexError):
+            return False
+
+    async def fast_client(self, deadline, timings):
+        while perf_counter() < deadline:
+            started = perf_counter()
+            try:
+                ok = await asyncio.wait_for(
+                    self.fetch(), deadline - started + 1
+                )
+            except (OSError, IndexError, asyncio.TimeoutError):
+                continue
+            if ok:
+                timings.append((perf_counter() - started) * 1000)
@@ -0,0 +1,201 @@
+from collections import defaultdict
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min
+
+from api.pantry import load_pairs
+from recipes.constant import SIMILAR_RECIPES_LIMIT
+from recipes.models import Favorite, Recipe, SimilarRecipe
+from recipes.recommendations import CoFavorites, first_per_recipe
+
+BATCH_SIZE = 500
+
+
+def chunks(values):
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+class Command(BaseCommand):
+    help = ('Recompute similar recipes for recipes whose favorites changed '
+            'since the last run')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Recompute similar recipes for all recipes'
+        )
+        parser.add_argument('--max-pairs', type=int, default=2_000_000)
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if not options['full']:
+            recipes = recipes.filter(similar_stale=True)
+        # С --full списки тоже заменяются по блокам, поэтому до конца
+        # пересчета API отдает прежние списки.
+        changed = list(recipes.values_list('id', flat=True))
+        changed = np.array(sorted(changed), dtype=np.int64)
+        self.changed_ids = set(changed.tolist())
+        index = CoFavorites(*load_pairs(
+            Favorite.objects.all(), ('recipe_id', 'user_id')
+        ))
+        # Рецепт без избранного уходит из чужих списков, и на освободившееся
+        # место может претендовать рецепт, не попавший в список, поэтому
+        # такие списки пересчитываются целиком.
+        demoted = set()
+        for chunk in chunks(changed[~index.contains(changed)].tolist()):
+            with transaction.atomic():
+                SimilarRecipe.objects.filter(recipe_id__in=chunk).delete()
+                emptied = SimilarRecipe.objects.filter(similar_id__in=chunk)
+                demoted.update(
+                    recipe_id for recipe_id in emptied.values_list(
+                        'recipe_id', flat=True
+                    ) if recipe_id not in self.changed_ids
+                    and index.contains([recipe_id])[0]
+                )
+                emptied.delete()
+                self.clear_stale(index, chunk)
+        self.load_stats(index)
+        for block in index.blocks(
+            index.positions(changed), options['max_pairs']
+        ):
+            with transaction.atomic():
+                demoted.update(self.replace(index, block, changed))
+                self.clear_stale(index, block.tolist())
+        demoted = np.array(sorted(demoted), dtype=np.int64)
+        for block in index.blocks(
+            index.positions(demoted), options['max_pairs']
+        ):
+            with transaction.atomic():
+                self.rebuild(index, block)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано похожих рецептов: {len(changed) + len(demoted)}'
+        ))
+
+    def clear_stale(self, index, recipe_ids):
+        """Снимает флаг с рецептов, избранное которых не менялось после
+        чтения матрицы.
+
+        Вызывается в транзакции, которая записывает списки рецептов:
+        если запуск прервется, необработанные рецепты останутся
+        помеченными. Строки рецептов блокируются до конца транзакции,
+        поэтому изменение избранного, зафиксированное позже, снова
+        поставит флаг.
+        """
+        for chunk in chunks(recipe_ids):
+            stale = list(Recipe.objects.select_for_update().filter(
+                pk__in=chunk, similar_stale=True
+            ).values_list('id', flat=True))
+            if not stale:
+                continue
+            users = defaultdict(set)
+            for recipe_id, user_id in Favorite.objects.filter(
+                recipe_id__in=stale
+            ).values_list('recipe_id', 'user_id'):
+                users[recipe_id].add(user_id)
+            Recipe.objects.filter(pk__in=[
+                recipe_id for recipe_id in stale
+                if users[recipe_id] == set(index.users(recipe_id).tolist())
+            ]).update(similar_stale=False)
+
+    def load_stats(self, index, recipe_ids=None):
+        """Запоминает число похожих и наименьшее сходство у рецептов."""
+        if recipe_ids is None:
+            self.counts = np.zeros(len(index.sizes), dtype=np.int64)
+            self.lowest = np.zeros(len(index.sizes))
+            batches = [SimilarRecipe.objects.all()]
+        else:
+            self.counts[index.positions(recipe_ids)] = 0
+            batches = (
+                SimilarRecipe.objects.filter(recipe_id__in=chunk)
+                for chunk in chunks(recipe_ids)
+            )
+        for queryset in batches:
+            rows = np.array(list(queryset.values('recipe').annotate(
+                total=Count('pk'), lowest=Min('score')
+            ).order_by().values_list('recipe', 'total', 'lowest')))
+            if not len(rows):
+                continue
+            present = index.contains(rows[:, 0])
+            positions = rows[present, 0].astype(np.int64)
+            self.counts[positions] = rows[present, 1]
+            self.lowest[positions] = rows[present, 2]
+
+    def rebuild(self, index, block):
+        """Заменяет списки похожих рецептов блока целиком."""
+        recipe_ids, similar_ids, scores = index.similar(block)
+        top = first_per_recipe(recipe_ids, SIMILAR_RECIPES_LIMIT)
+        self.save(block.tolist(), (
+            recipe_ids[top], similar_ids[top], scores[top]
+        ))
+        return recipe_ids, similar_ids, scores
+
+    def save(self, block_ids, *rows):
+        SimilarRecipe.objects.filter(recipe_id__in=block_ids).delete()
+        SimilarRecipe.objects.bulk_create(
+            (
+                SimilarRecipe(
+                    recipe_id=recipe_id, similar_id=similar_id, score=score
+                ) for recipe_ids, similar_ids, scores in rows
+                for recipe_id, similar_id, score in zip(
+                    recipe_ids.tolist(), similar_ids.tolist(),
+                    scores.tolist()
+                )
+            ),
+            batch_size=BATCH_SIZE
+        )
+
+    def replace(self, index, block, changed):
+        """Пересчитывает похожие рецепты блока измененных рецептов.
+
+        Рецепты блока получают новый список целиком. В списки остальных
+        рецептов рецепт блока попадает с новым сходством, если уже был
+        там или теперь вытесняет наименее похожий. Возвращает рецепты,
+        в полных списках которых сходство с рецептом блока упало: на его
+        место может претендовать рецепт, не попавший в список, поэтому
+        такие списки пересчитываются целиком.
+        """
+        block_ids = block.tolist()
+        # Списки рецептов, избранное которых опустело, обновит запуск
+        # по их собственному флагу.
+        existing = [
+            row for chunk in chunks(block_ids)
+            for row in SimilarRecipe.objects.filter(
+                similar_id__in=chunk
+            ).values_list('id', 'recipe_id', 'similar_id', 'score')
+            if row[1] not in self.changed_ids
+            and index.contains([row[1]])[0]
+        ]
+        recipe_ids, similar_ids, scores = self.rebuild(index, block)
+        reverse = ~np.isin(similar_ids, changed)
+        owners, others = similar_ids[reverse], recipe_ids[reverse]
+        scores = scores[reverse]
+        new_scores = dict(zip(
+            zip(owners.tolist(), others.tolist()), scores.tolist()
+        ))
+        previous = {(row[1], row[2]): row[3] for row in existing}
+        kept = (
+            (self.counts[owners] < SIMILAR_RECIPES_LIMIT)
+            | (scores >= self.lowest[owners])
+            | np.array([pair in previous for pair in new_scores], dtype=bool)
+        )
+        previous_owners = np.array(
+            [row[1] for row in existing], dtype=np.int64
+        )
+        demoted = previous_owners[
+            (self.counts[previous_owners] >= SIMILAR_RECIPES_LIMIT)
+            & (np.array([
+                new_scores.get(pair, 0) for pair in previous
+            ]) < np.array(list(previous.values())))
+        ]
+        for chunk in chunks(row[0] for row in existing):
+            SimilarRecipe.objects.filter(pk__in=chunk).delete()
+        self.save([], (owners[kept], others[kept], scores[kept]))
+        touched = np.unique(np.r_[owners[kept], previous_owners]).tolist()
+        for chunk in chunks(touched):
+            SimilarRecipe.objects.trim(chunk, SIMILAR_RECIPES_LIMIT)
+        self.load_stats(index, touched)
+        return demoted.tolist()
@@ -0,0 +1,165 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.catalogue import ingredient_catalogue, tag_catalogue
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag, TagInRecipe)
+from users.models import Subscribe
+
+User = get_user_model()
+
+USERNAME_PREFIX = 'bench_user_'
+MIN_INGREDIENTS = 100
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with synthetic users, subscriptions, '
+            'recipes, favorites and shopping carts')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10_000)
+        parser.add_argument('--tags', type=int, default=6)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--subscriptions', type=int, default=20)
+        parser.add_argument('--favorites', type=int, default=30)
+        parser.add_argument('--cart', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            tag_ids = self.create_tags(options['tags'])
+            ingredient_ids = self.create_ingredients()
+            user_ids = self.create_users(options['users'])
+            recipe_ids = self.create_recipes(
+                options['recipes'], user_ids, tag_ids, ingredient_ids,
+                options['ingredients_per_recipe']
+            )
+            self.create_links(
+                Subscribe, user_ids, user_ids, options['subscriptions'],
+                'author_id'
+            )
+            self.create_links(
+                Favorite, user_ids, recipe_ids, options['favorites'],
+                'recipe_id'
+            )
+            self.create_links(
+                ShoppingCart, user_ids, recipe_ids, options['cart'],
+                'recipe_id'
+            )
+        tag_catalogue.invalidate()
+        ingredient_catalogue.invalidate()
+        call_command('recount_recipe_counters', stdout=self.stdout)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        call_command('rebuild_recipe_search', stdout=self.stdout)
+        call_command('rebuild_feeds', stdout=self.stdout)
+        call_command('build_recommendations', '--full', stdout=self.stdout)
+        call_command('score_trending', '--full', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, '
+            f'рецептов: {len(recipe_ids)}'
+        ))
+
+    def create_tags(self, count):
+        existing = Tag.objects.count()
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {i}', slug=f'bench-{i}', color=f'#BE{i:04X}')
+            for i in range(existing, count)
+        )
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def create_ingredients(self):
+        existing = Ingredient.objects.count()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(existing, MIN_INGREDIENTS)
+        )
+        return list(Ingredient.objects.values_list('id', flat=True))
+
+    def create_users(self, count):
+        start = User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).count()
+        password = make_password(None)
+        last_id = self.last_id(User)
+        User.objects.bulk_create(
+            (User(
+                username=f'{USERNAME_PREFIX}{i}',
+                email=f'{USERNAME_PREFIX}{i}@example.com',
+                first_name='Тест',
+                last_name='Тестов',
+                password=password,
+            ) for i in range(start, start + count)),
+            batch_size=self.batch_size
+        )
+        return list(User.objects.filter(pk__gt=last_id).values_list(
+            'id', flat=True
+        ))
+
+    def create_recipes(self, count, user_ids, tag_ids, ingredient_ids,
+                       ingredients_per_recipe):
+        recipe_ids = []
+        per_recipe = min(ingredients_per_recipe, len(ingredient_ids))
+        for start in range(0, count, self.batch_size):
+            last_id = self.last_id(Recipe)
+            Recipe.objects.bulk_create(
+                Recipe(
+                    name=f'Рецепт {start + i}',
+                    text='Описание рецепта ' * 20,
+                    cooking_time=random.randint(5, 120),
+                    image='recipes/images/bench.png',
+                    author_id=random.choice(user_ids),
+                ) for i in range(min(self.batch_size, count - start))
+            )
+            ids = list(Recipe.objects.filter(pk__gt=last_id).values_list(
+                'id', flat=True
+            ))
+            TagInRecipe.objects.bulk_create(
+                TagInRecipe(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in ids
+                for tag_id in random.sample(
+                    tag_ids, random.randint(1, min(3, len(tag_ids)))
+                )
+            )
+            IngredientInRecipe.objects.bulk_create(
+                (IngredientInRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=random.randint(1, 500)
+                ) for recipe_id in ids
+                    for ingredient_id in random.sample(
+                        ingredient_ids, per_recipe
+                )),
+                batch_size=self.batch_size
+            )
+            recipe_ids.extend(ids)
+        return recipe_ids
+
+    def create_links(self, model, user_ids, target_ids, per_user, field):
+        per_user = min(per_user, len(target_ids) - 1)
+        if per_user <= 0:
+            return
+        batch = []
+        for user_id in user_ids:
+            for target_id in random.sample(target_ids, per_user):
+                if model is Subscribe and target_id == user_id:
+                    continue
+                batch.append(model(user_id=user_id, **{field: target_id}))
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+
+    @staticmethod
+    def last_id(model):
+        return model.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
@@ -1,44 +1,176 @@
 import csv
 import json
+from io import StringIO
+from itertools import islice
+from pathlib import Path
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from api.catalogue import ingredient_catalogue
 from recipes.models import Ingredient
 
+DEFAULT_FILES = (
+    f'{settings.BASE_DIR}/data/ingredients.csv',
+    f'{settings.BASE_DIR}/data/ingredients.json',
+)
+JSON_CHUNK_SIZE = 64 * 1024
 
-class Command(BaseCommand):
-    help = 'Import json and csv files into database'
 
-    def handle(self, *args, **options):
-        if Ingredient.objects.exists():
-            self.stdout.write(self.style.SUCCESS(
-                'Данные уже загружены, нет необходимости повторной загрузки.'
-            ))
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+def read_ndjson(file):
+    for line in file:
+        if line.strip():
+            item = json.loads(line)
+            yield item['name'], item['measurement_unit']
+
+
+def read_json(file):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and buffer[position:position + 1] == '[':
+                started = True
+                position += 1
+                continue
+            if buffer[position:position + 1] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+            yield item['name'], item['measurement_unit']
+        buffer = buffer[position:]
+        if not chunk:
             return
 
-        with open(
-            f'{settings.BASE_DIR}/data/ingredients.csv',
-            'r',
-            encoding='utf-8'
-        ) as csv_file:
-            csv_data = csv.reader(csv_file)
-            Ingredient.objects.bulk_create(
-                Ingredient(name=row[0], measurement_unit=row[1])
-                for row in csv_data
-            )
 
-        with open(
-            f'{settings.BASE_DIR}/data/ingredients.json',
-            'r',
-            encoding='utf-8'
-        ) as json_file:
-            json_data = json.load(json_file)
-            for item in json_data:
-                Ingredient.objects.create(
-                    name=item['name'],
-                    measurement_unit=item['measurement_unit']
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+    '.ndjson': read_ndjson,
+    '.jsonl': read_ndjson,
+}
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class CopyStream:
+    """Файлоподобный объект, отдающий строки в CSV для COPY FROM STDIN."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        output = StringIO()
+        writer = csv.writer(output)
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            writer.writerow(row)
+            self.count += 1
+            self.buffer += output.getvalue()
+            output.seek(0)
+            output.truncate()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class Command(BaseCommand):
+    help = 'Import ingredients from csv, json and ndjson files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', default=DEFAULT_FILES)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Do not use COPY on PostgreSQL'
+        )
+
+    def read(self, files):
+        for name in files:
+            path = Path(name)
+            reader = READERS.get(path.suffix.lower())
+            if reader is None:
+                raise CommandError(f'Неизвестный формат файла: {path}')
+            with open(path, 'r', encoding='utf-8') as file:
+                yield from reader(file)
+
+    def handle(self, *args, **options):
+        rows = self.read(options['files'])
+        with transaction.atomic():
+            if connection.vendor == 'postgresql' and not options['no_copy']:
+                total, inserted = self.copy(rows)
+            else:
+                total, inserted = self.bulk_insert(
+                    rows, options['batch_size']
                 )
+        ingredient_catalogue.invalidate()
         self.stdout.write(self.style.SUCCESS(
-            'Успешно выгружены данные с csv и json файла'
+            f'Обработано строк: {total}, добавлено: {inserted}, '
+            f'пропущено: {total - inserted}'
         ))
+
+    def bulk_insert(self, rows, batch_size):
+        total = 0
+        before = Ingredient.objects.count()
+        for batch in batches(rows, batch_size):
+            total += len(batch)
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in dict.fromkeys(batch)),
+                ignore_conflicts=True
+            )
+        return total, Ingredient.objects.count() - before
+
+    def copy(self, rows):
+        """Загружает строки через COPY во временную таблицу и переносит
+        новые ингредиенты одним INSERT ... ON CONFLICT DO NOTHING."""
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        stream = CopyStream(rows)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_import '
+                '(name text, measurement_unit text) ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                stream
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return stream.count, cursor.rowcount
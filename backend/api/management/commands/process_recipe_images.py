@@ -0,0 +1,50 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.images import render_variants, save_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Generate missing or outdated thumbnails for recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Обработать все картинки, а не только необработанные'
+        )
+        parser.add_argument(
+            '--workers', type=int,
+            default=settings.IMAGE_PROCESSING_WORKERS or 1
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'image_variants'
+        )
+        processed = failed = 0
+        with ProcessPoolExecutor(options['workers']) as executor:
+            futures = {}
+            for recipe in recipes.iterator():
+                name = recipe.image.name
+                if (options['all']
+                        or recipe.image_variants.get('source') != name):
+                    # Оригинал уже обработанной картинки не пережимается.
+                    future = executor.submit(
+                        render_variants, settings.MEDIA_ROOT, name,
+                        recipe.image_variants.get('source') != name
+                    )
+                    futures[future] = (recipe.pk, name)
+            for future in as_completed(futures):
+                recipe_id, name = futures[future]
+                try:
+                    save_variants(recipe_id, name, future.result())
+                    processed += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+        self.stdout.write(
+            f'Обработано картинок: {processed}, ошибок: {failed}'
+        )
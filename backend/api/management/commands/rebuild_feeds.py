@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FeedItem, User
+from users.models import Subscribe
+
+
+def count_followers():
+    return Coalesce(Subquery(
+        Subscribe.objects.filter(author=OuterRef('pk')).order_by().values(
+            'author'
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Recount followers and rebuild subscription feeds, e.g. after '
+            'bulk changes to subscriptions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        User.objects.annotate(actual=count_followers()).exclude(
+            followers_count=F('actual')
+        ).update(followers_count=count_followers())
+        user_ids = list(Subscribe.objects.order_by('user_id').values_list(
+            'user_id', flat=True
+        ).distinct())
+        FeedItem.objects.exclude(Exists(Subscribe.objects.filter(
+            user=OuterRef('user')
+        ))).delete()
+        batch_size = options['batch_size']
+        for start in range(0, len(user_ids), batch_size):
+            with transaction.atomic():
+                FeedItem.objects.rebuild(user_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано лент подписок: {len(user_ids)}'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from recipes.models import Recipe
+from recipes.search import rebuild_recipe_search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search documents of all recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        rebuild_recipe_search(options['database'])
+        self.stdout.write(self.style.SUCCESS(
+            'Проиндексировано рецептов: '
+            f'{Recipe.objects.using(options["database"]).count()}'
+        ))
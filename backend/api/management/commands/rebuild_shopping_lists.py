@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+
+from api.shopping_list import bump_cart_versions
+from recipes.models import IngredientInRecipe, ShoppingListItem
+
+
+def expected_rows():
+    return IngredientInRecipe.objects.filter(
+        recipe__shopping_cart__isnull=False
+    ).values(
+        'recipe__shopping_cart__user', 'ingredient'
+    ).annotate(
+        total=Coalesce(Sum('amount'), 0),
+        recipes=Count('pk'),
+    ).order_by().values_list(
+        'recipe__shopping_cart__user', 'ingredient', 'total', 'recipes'
+    )
+
+
+class Command(BaseCommand):
+    help = 'Rebuild shopping list aggregates that drifted from the carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        actual = set(ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'amount', 'recipes_count'
+        ).iterator())
+        expected = set(expected_rows().iterator())
+        drifted = sorted({row[0] for row in actual ^ expected})
+        batch_size = options['batch_size']
+        for start in range(0, len(drifted), batch_size):
+            with transaction.atomic():
+                ShoppingListItem.objects.rebuild(
+                    drifted[start:start + batch_size]
+                )
+        bump_cart_versions(drifted)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересобрано списков покупок: {len(drifted)}'
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+
+
+def count_for_recipe(model):
+    return Coalesce(Subquery(
+        model.objects.filter(recipe=OuterRef('pk')).order_by().values(
+            'recipe'
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Reconcile favorites_count and shopping_cart_count with the data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drifted = list(Recipe.objects.annotate(
+            actual_favorites=count_for_recipe(Favorite),
+            actual_shopping_cart=count_for_recipe(ShoppingCart),
+        ).exclude(
+            favorites_count=F('actual_favorites'),
+            shopping_cart_count=F('actual_shopping_cart'),
+        ).values_list('pk', flat=True))
+        batch_size = options['batch_size']
+        for start in range(0, len(drifted), batch_size):
+            Recipe.objects.filter(
+                pk__in=drifted[start:start + batch_size]
+            ).update(
+                favorites_count=count_for_recipe(Favorite),
+                shopping_cart_count=count_for_recipe(ShoppingCart),
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков рецептов: {len(drifted)}'
+        ))
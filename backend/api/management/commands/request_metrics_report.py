@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+
+from api.metrics import (histogram_percentile, load_endpoint_stats,
+                         load_samples)
+from api.response_cache import get_stats
+
+
+class Command(BaseCommand):
+    help = ('Show endpoints ranked by p95 latency and queries per request, '
+            'and the slowest sampled requests')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10)
+
+    def handle(self, *args, **options):
+        hits, misses = get_stats()
+        self.stdout.write(
+            f'Кэш ответов для анонимных пользователей: попаданий {hits}, '
+            f'промахов {misses}'
+        )
+        endpoints = load_endpoint_stats()
+        if not endpoints:
+            self.stdout.write('Нет собранных метрик.')
+            return
+        rows = [
+            {
+                'endpoint': endpoint,
+                'count': stats['count'],
+                'p50': histogram_percentile(stats['histogram'], 50),
+                'p95': histogram_percentile(stats['histogram'], 95),
+                'queries': stats['queries'] / stats['count'],
+                'max_queries': stats['max_queries'],
+                'db': stats['db_ms'] / stats['count'],
+            }
+            for endpoint, stats in endpoints.items()
+        ]
+        top = options['top']
+        self.write_table(
+            'По p95 времени ответа',
+            sorted(rows, key=lambda row: row['p95'], reverse=True)[:top]
+        )
+        self.write_table(
+            'По числу запросов к БД',
+            sorted(rows, key=lambda row: row['queries'], reverse=True)[:top]
+        )
+        self.write_slowest(load_samples()[:top])
+
+    def write_table(self, title, rows):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        self.stdout.write(
+            f'{"endpoint":<45} {"n":>6} {"p50 ms":>9} {"p95 ms":>9} '
+            f'{"db ms":>9} {"queries":>8} {"max":>5}'
+        )
+        for row in rows:
+            self.stdout.write(
+                f'{row["endpoint"]:<45} {row["count"]:>6} '
+                f'{row["p50"]:>9.1f} {row["p95"]:>9.1f} {row["db"]:>9.1f} '
+                f'{row["queries"]:>8.1f} {row["max_queries"]:>5}'
+            )
+
+    def write_slowest(self, records):
+        self.stdout.write(
+            self.style.MIGRATE_HEADING('Самые медленные запросы')
+        )
+        self.stdout.write(
+            f'{"endpoint":<45} {"status":>6} {"total ms":>9} {"db ms":>9} '
+            f'{"app ms":>9} {"queries":>8}'
+        )
+        for record in records:
+            self.stdout.write(
+                f'{record["endpoint"]:<45} {record["status"]:>6} '
+                f'{record["total_ms"]:>9.1f} {record["db_ms"]:>9.1f} '
+                f'{record["app_ms"]:>9.1f} {record["queries"]:>8}'
+            )
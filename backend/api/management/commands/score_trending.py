@@ -0,0 +1,107 @@
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.constant import TRENDING_HORIZON, TRENDING_SETTLE_TIME
+from recipes.models import (Favorite, Recipe, ShoppingCart,
+                            TrendingCheckpoint, TrendingRecipe)
+from recipes.trending import event_scores
+
+BATCH_SIZE = 500
+CHUNK_SIZE = 50000
+
+
+def chunks(values):
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+class Command(BaseCommand):
+    help = ('Add favorites and shopping cart additions made since the last '
+            'run to the time-decayed recipe popularity')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Recompute popularity from the events of the last 30 days'
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # Строки с отметкой времени чуть раньше now могут быть еще
+        # не зафиксированы, поэтому последние секунды ждут следующего
+        # запуска.
+        until = now - timedelta(seconds=TRENDING_SETTLE_TIME)
+        with transaction.atomic():
+            checkpoint, created = (
+                TrendingCheckpoint.objects.select_for_update().get_or_create(
+                    pk=1, defaults={'scored_until': until}
+                )
+            )
+            if created or options['full']:
+                TrendingRecipe.objects.all().delete()
+                since = now - timedelta(seconds=TRENDING_HORIZON)
+            else:
+                since = checkpoint.scored_until
+            recipe_ids, timestamps = self.load_events(since, until)
+            recipe_ids, scores = event_scores(recipe_ids, timestamps)
+            for chunk in chunks(range(len(recipe_ids))):
+                self.save(recipe_ids[chunk], scores[chunk])
+            TrendingRecipe.objects.prune(now)
+            checkpoint.scored_until = max(until, since)
+            checkpoint.save(update_fields=('scored_until', ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Учтено событий: {len(timestamps)}, '
+            f'обновлено рецептов: {len(recipe_ids)}'
+        ))
+
+    def load_events(self, since, until):
+        """Читает id рецептов и время событий в промежутке (since, until]."""
+        recipe_ids, timestamps = [], []
+        for model in (Favorite, ShoppingCart):
+            rows = model.objects.filter(
+                created__gt=since, created__lte=until
+            ).values_list('recipe_id', 'created').iterator(
+                chunk_size=CHUNK_SIZE
+            )
+            while True:
+                chunk = list(islice(rows, CHUNK_SIZE))
+                if not chunk:
+                    break
+                recipe_ids.append(np.array(
+                    [recipe_id for recipe_id, _ in chunk], dtype=np.int64
+                ))
+                timestamps.append(np.array(
+                    [created.timestamp() for _, created in chunk]
+                ))
+        return (
+            np.concatenate([np.zeros(0, dtype=np.int64), *recipe_ids]),
+            np.concatenate([np.zeros(0), *timestamps])
+        )
+
+    def save(self, recipe_ids, scores):
+        """Прибавляет вклады новых событий к сохраненной популярности.
+
+        Рецепты, удаленные после чтения событий, пропускаются.
+        """
+        existing = Recipe.objects.filter(
+            pk__in=recipe_ids.tolist()
+        ).values_list('id', flat=True)
+        kept = np.isin(recipe_ids, np.array(list(existing), dtype=np.int64))
+        recipe_ids, scores = recipe_ids[kept].tolist(), scores[kept]
+        previous = dict(TrendingRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'score'))
+        scores = np.logaddexp2(scores, np.array(
+            [previous.get(recipe_id, -np.inf) for recipe_id in recipe_ids]
+        ))
+        TrendingRecipe.objects.filter(recipe_id__in=previous).delete()
+        TrendingRecipe.objects.bulk_create(
+            TrendingRecipe(recipe_id=recipe_id, score=score)
+            for recipe_id, score in zip(recipe_ids, scores.tolist())
+        )
@@ -0,0 +1,260 @@
+import atexit
+import heapq
+import json
+import logging
+import math
+import os
+import random
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from threading import Lock, Timer
+from time import perf_counter, sleep
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger('api.metrics')
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+SLOWEST_KEY = 'request_metrics:slowest_samples'
+ENDPOINTS_KEY = 'request_metrics:endpoints'
+# Границы корзин гистограммы времени ответа растут в HISTOGRAM_GROWTH
+# раз, поэтому перцентили считаются с точностью до 5%.
+HISTOGRAM_GROWTH = 1.05
+REGISTER_ATTEMPTS = 5
+
+
+class RequestMetrics:
+    """Метрики одного запроса: число и время SQL-запросов, время
+    обработчика DRF без SQL и общее время обработки."""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.app_time = 0.0
+        self._handler_started = None
+        self._handler_db_time = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += perf_counter() - started
+
+    def handler_started(self):
+        self._handler_started = perf_counter()
+        self._handler_db_time = self.db_time
+
+    def handler_finished(self):
+        """Время обработчика без учета SQL: проверки прав, фильтры,
+        пагинация и сериализация."""
+        if self._handler_started is None:
+            return
+        handler_time = perf_counter() - self._handler_started
+        db_time = self.db_time - self._handler_db_time
+        self.app_time += max(handler_time - db_time, 0)
+        self._handler_started = None
+
+    def server_timing(self, total):
+        return (
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries", '
+            f'app;dur={self.app_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+
+
+class ProcessMetrics:
+    """Метрики процесса, публикуемые в кэш metrics.
+
+    Каждый процесс пишет свое состояние под собственным ключом, а ключи
+    перечислены в списке под key, поэтому воркеры не затирают данные
+    друг друга. Первая запись после публикации заводит таймер
+    на REQUEST_METRICS_FLUSH_INTERVAL секунд, так что затихший воркер
+    тоже публикует последние записи; остаток публикуется при выходе
+    процесса. Ключи процессов живут REQUEST_METRICS_RETENTION секунд
+    после последней публикации.
+    """
+
+    key = None
+
+    def __init__(self):
+        self._lock = Lock()
+        self._timer = None
+        self._changed = False
+        self._process_key = None
+        atexit.register(self.flush)
+
+    def collect(self, record):
+        raise NotImplementedError
+
+    def state(self):
+        raise NotImplementedError
+
+    def add(self, record):
+        with self._lock:
+            self.collect(record)
+            self._changed = True
+            if self._timer is None:
+                self._timer = Timer(
+                    settings.REQUEST_METRICS_FLUSH_INTERVAL, self.flush
+                )
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._changed:
+                return
+            self._changed = False
+            state = self.state()
+            key = self.get_process_key()
+        cache = caches['metrics']
+        cache.set(key, state, settings.REQUEST_METRICS_RETENTION)
+        # Процессы, одновременно дописавшие себя в список, могут затереть
+        # друг друга, поэтому запись проверяется повторным чтением.
+        for _ in range(REGISTER_ATTEMPTS):
+            keys = cache.get(self.key, ())
+            if key in keys:
+                return
+            # Заодно из списка убираются ключи, срок которых истек.
+            cache.set(self.key, [*cache.get_many(keys), key], None)
+            sleep(random.uniform(0, 0.05))
+
+    def get_process_key(self):
+        # После fork воркер gunicorn получает собственный ключ.
+        pid = os.getpid()
+        if self._process_key is None or self._process_key[0] != pid:
+            self._process_key = (pid, f'{self.key}:{uuid4().hex}')
+        return self._process_key[1]
+
+    @classmethod
+    def load_states(cls):
+        cache = caches['metrics']
+        return list(cache.get_many(cache.get(cls.key, ())).values())
+
+
+class SlowestSamples(ProcessMetrics):
+    """Самые медленные из выбранных запросов: не больше
+    REQUEST_METRICS_BUFFER_SIZE записей в каждом процессе."""
+
+    key = SLOWEST_KEY
+
+    def __init__(self):
+        super().__init__()
+        self._heap = []
+
+    def collect(self, record):
+        item = (record['total_ms'], uuid4().hex, record)
+        if len(self._heap) < settings.REQUEST_METRICS_BUFFER_SIZE:
+            heapq.heappush(self._heap, item)
+        elif item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+
+    def state(self):
+        return list(self._heap)
+
+
+class EndpointStats(ProcessMetrics):
+    """Сводка по всем выбранным запросам каждого эндпоинта.
+
+    Время ответа хранится гистограммой, число и время SQL-запросов —
+    суммами, поэтому сводки процессов складываются без искажений.
+    """
+
+    key = ENDPOINTS_KEY
+
+    def __init__(self):
+        super().__init__()
+        self._endpoints = defaultdict(new_endpoint_stats)
+
+    def collect(self, record):
+        stats = self._endpoints[record['endpoint']]
+        stats['count'] += 1
+        stats['histogram'][histogram_bucket(record['total_ms'])] += 1
+        stats['queries'] += record['queries']
+        stats['max_queries'] = max(stats['max_queries'], record['queries'])
+        stats['db_ms'] += record['db_ms']
+
+    def state(self):
+        return {
+            endpoint: dict(stats, histogram=dict(stats['histogram']))
+            for endpoint, stats in self._endpoints.items()
+        }
+
+
+def new_endpoint_stats():
+    return {
+        'count': 0, 'histogram': Counter(), 'queries': 0,
+        'max_queries': 0, 'db_ms': 0.0,
+    }
+
+
+def histogram_bucket(total_ms):
+    if total_ms < HISTOGRAM_GROWTH:
+        return 0
+    return int(math.log(total_ms, HISTOGRAM_GROWTH))
+
+
+def histogram_percentile(histogram, percent):
+    """Верхняя граница корзины, в которую попадает перцентиль."""
+    rank = sum(histogram.values()) * percent / 100
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return HISTOGRAM_GROWTH ** (bucket + 1)
+    return 0.0
+
+
+slowest_samples = SlowestSamples()
+endpoint_stats = EndpointStats()
+
+
+def store_sample(record):
+    slowest_samples.add(record)
+    endpoint_stats.add(record)
+
+
+def load_samples():
+    """Самые медленные записи всех процессов, начиная с самой
+    медленной."""
+    return [record for _, _, record in heapq.nlargest(
+        settings.REQUEST_METRICS_BUFFER_SIZE,
+        (item for state in SlowestSamples.load_states() for item in state)
+    )]
+
+
+def load_endpoint_stats():
+    """Сводки эндпоинтов, сложенные по всем процессам."""
+    endpoints = defaultdict(new_endpoint_stats)
+    for state in EndpointStats.load_states():
+        for endpoint, stats in state.items():
+            total = endpoints[endpoint]
+            total['count'] += stats['count']
+            total['histogram'].update({
+                int(bucket): count
+                for bucket, count in stats['histogram'].items()
+            })
+            total['queries'] += stats['queries']
+            total['max_queries'] = max(
+                total['max_queries'], stats['max_queries']
+            )
+            total['db_ms'] += stats['db_ms']
+    return dict(endpoints)
+
+
+def log_sample(record):
+    level = (
+        logging.WARNING
+        if record['total_ms'] >= settings.SLOW_REQUEST_THRESHOLD_MS
+        else logging.INFO
+    )
+    logger.log(level, json.dumps(record, ensure_ascii=False))
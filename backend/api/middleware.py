@@ -0,0 +1,154 @@
+import asyncio
+import random
+from contextlib import ExitStack
+from hashlib import sha256
+from time import perf_counter
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from foodgram.db_router import REPLICA_DB_ALIAS, RoutingState, routing_state
+
+from .metrics import RequestMetrics, current_metrics, log_sample, store_sample
+
+
+class RequestMetricsMiddleware:
+    """Собирает метрики для доли запросов, заданной в настройках.
+
+    Для выбранных запросов добавляет заголовок Server-Timing, пишет
+    структурированную строку в лог, учитывает запрос в сводке его
+    эндпоинта и сохраняет самые медленные записи для команды
+    request_metrics_report.
+
+    В режиме ASGI запросы вне выборки проходят асинхронно, а выбранные
+    обрабатываются в потоке, чтобы считать запросы к базе на его
+    соединениях.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        return self.measure(request, self.get_response)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE:
+            return await self.get_response(request)
+        return await sync_to_async(self.measure)(
+            request, async_to_sync(self.get_response)
+        )
+
+    def measure(self, request, get_response):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.record_query)
+                    )
+                response = get_response(request)
+        finally:
+            current_metrics.reset(token)
+        total = perf_counter() - metrics.started
+        response['Server-Timing'] = metrics.server_timing(total)
+        match = request.resolver_match
+        record = {
+            'endpoint': f'{request.method} '
+                        f'{match.view_name if match else request.path}',
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'app_ms': round(metrics.app_time * 1000, 2),
+            'queries': metrics.queries,
+            'size': (
+                None if response.streaming else len(response.content)
+            ),
+        }
+        log_sample(record)
+        store_sample(record)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """Выбирает базу для чтения: реплику для безопасных запросов.
+
+    Небезопасные запросы и все запросы клиента в течение
+    REPLICA_STICKY_SECONDS после его записи читают основную базу,
+    поэтому клиент всегда видит свои изменения. Клиент определяется
+    по заголовку Authorization, а без него — по ключу сессии.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = REPLICA_DB_ALIAS in settings.DATABASES
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        state = RoutingState(self.needs_primary(request))
+        token = routing_state.set(state)
+        try:
+            return self.get_response(request)
+        finally:
+            routing_state.reset(token)
+            self.finish(request, state)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        state = RoutingState(
+            await sync_to_async(self.needs_primary)(request)
+        )
+        token = routing_state.set(state)
+        try:
+            return await self.get_response(request)
+        finally:
+            routing_state.reset(token)
+            await sync_to_async(self.finish)(request, state)
+
+    @staticmethod
+    def pin_key(request):
+        client = request.META.get('HTTP_AUTHORIZATION')
+        if not client:
+            # Сессия появляется у запроса только внутри SessionMiddleware,
+            # после входа в ней уже новый ключ, который клиент пришлет
+            # в следующем запросе в cookie.
+            session = getattr(request, 'session', None)
+            client = (
+                session.session_key if session is not None
+                else request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+            )
+        if not client:
+            return None
+        return 'db_primary_pin:' + sha256(client.encode()).hexdigest()
+
+    def needs_primary(self, request):
+        if request.method not in SAFE_METHODS:
+            return True
+        key = self.pin_key(request)
+        return key is not None and cache.get(key) is not None
+
+    def finish(self, request, state):
+        key = self.pin_key(request)
+        if state.wrote and key is not None:
+            cache.set(key, 1, settings.REPLICA_STICKY_SECONDS)
@@ -0,0 +1,122 @@
+from django.http import Http404
+from rest_framework import status
+from rest_framework.response import Response
+
+from foodgram.db_router import use_primary
+
+from . import response_cache
+from .metrics import current_metrics
+
+
+class CatalogueMixin:
+    """Отдает справочник из кэша в памяти с поддержкой ETag.
+
+    Ответ зависит только от версии справочника и адреса запроса, поэтому
+    версия служит ETag-ом для любого GET-запроса к справочнику.
+    """
+
+    catalogue = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.snapshot = self.catalogue.load()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        snapshot = getattr(self, 'snapshot', None)
+        if snapshot is not None and response.status_code in (
+            status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED
+        ):
+            response['ETag'] = snapshot.etag
+        return response
+
+    def not_modified(self, request):
+        return request.headers.get('If-None-Match') == self.snapshot.etag
+
+    def list(self, request, *args, **kwargs):
+        if self.not_modified(request):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        if self.is_filtered(request):
+            return super().list(request, *args, **kwargs)
+        return Response(self.snapshot.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.not_modified(request):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        try:
+            pk = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            raise Http404
+        data = self.snapshot.data_by_id.get(pk)
+        if data is None:
+            raise Http404
+        return Response(data)
+
+    def is_filtered(self, request):
+        return False
+
+
+class MetricsMixin:
+    """Отмечает границы обработчика DRF для подсчета его времени
+    без SQL в RequestMetricsMiddleware."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.handler_started()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.handler_finished()
+        return super().finalize_response(
+            request, response, *args, **kwargs
+        )
+
+
+class AnonymousResponseCacheMixin:
+    """Кэширует ответы list и retrieve для анонимных пользователей.
+
+    Ключ строится из нормализованной строки запроса и версий, которые
+    сбрасываются сигналами при изменении рецептов и профилей авторов.
+    Заголовок X-Cache-Bypass пропускает чтение из кэша.
+    """
+
+    def list(self, request, *args, **kwargs):
+        query = response_cache.normalize_query(request.query_params)
+        if request.user.is_authenticated or query is None:
+            return super().list(request, *args, **kwargs)
+        return self.cached(
+            request, response_cache.list_key(request, query),
+            super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        if request.user.is_authenticated or not str(pk).isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached(
+            request, response_cache.detail_key(request, int(pk)),
+            super().retrieve, *args, **kwargs
+        )
+
+    def cached(self, request, key, handler, *args, **kwargs):
+        if request.headers.get(response_cache.BYPASS_HEADER):
+            state, data = 'BYPASS', None
+        else:
+            data = response_cache.get_response_data(key)
+            state = 'MISS' if data is None else 'HIT'
+        if data is not None:
+            response = Response(data)
+        else:
+            # Ответ ляжет в кэш под новой версией, поэтому читается
+            # с основной базы, а не с отстающей реплики.
+            with use_primary():
+                response = handler(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response_cache.set_response_data(key, response.data)
+        response['X-Cache'] = state
+        return response
@@ -1,6 +1,96 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
 
+from recipes.constant import MAX_PAGE_SIZE
 
-class CustomPagination(PageNumberPagination):
+
+class CustomCursorPagination(CursorPagination):
     page_size = 6
     page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    ordering = '-id'
+
+
+class FeedPagination(CustomCursorPagination):
+    """Курсор по id рецепта для ленты подписок.
+
+    Вместо queryset принимает ленту с методом page(before, limit),
+    листать можно только вперед.
+    """
+
+    def paginate_queryset(self, timeline, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+        before = None
+        if self.cursor is not None:
+            try:
+                before = int(self.cursor.position)
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        recipes = timeline.page(before, self.page_size + 1)
+        self.has_next = len(recipes) > self.page_size
+        self.page = recipes[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=self.page[-1].pk)
+        )
+
+    def get_previous_link(self):
+        return None
+
+
+class LimitPageNumberPagination(PageNumberPagination):
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+
+
+class CustomPagination(LimitPageNumberPagination):
+    """Постраничная пагинация с опциональным режимом курсора.
+
+    Если в запросе передан параметр cursor (для первой страницы — пустой),
+    выдача строится по ключу сортировки без COUNT(*) и OFFSET. Ключ
+    задается атрибутом cursor_ordering представления, по умолчанию -id.
+    Сортировка по неуникальному полю в этом режиме отклоняется.
+    """
+
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_query_param = CustomCursorPagination.cursor_query_param
+        if cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_paginator = CustomCursorPagination()
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering is not None:
+            self.cursor_paginator.ordering = ordering
+        # Курсор хранит только значение первого ключа сортировки: при
+        # повторах он листал бы сдвигом внутри группы равных значений.
+        key = self.cursor_paginator.get_ordering(
+            request, queryset, view
+        )[0].lstrip('-')
+        try:
+            unique = queryset.model._meta.get_field(key).unique
+        except FieldDoesNotExist:
+            unique = False
+        if not unique:
+            raise ValidationError({'ordering': (
+                'В режиме курсора доступна только сортировка '
+                'по уникальному полю.'
+            )})
+        return self.cursor_paginator.paginate_queryset(
+            queryset, request, view
+        )
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
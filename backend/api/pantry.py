@@ -0,0 +1,204 @@
+import logging
+from itertools import islice
+from threading import Lock, Thread, local
+from time import monotonic
+from uuid import uuid4
+
+import numpy as np
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import QuerySet
+
+from recipes.models import IngredientInRecipe
+from recipes.search import RecipeIngredientIndex
+
+GENERATION_KEY = 'recipe_ingredient_index:generation'
+SEQUENCE_KEY = 'recipe_ingredient_index:sequence'
+CHANGES_KEY = 'recipe_ingredient_index:changes:{sequence}'
+CHANGES_TIMEOUT = 24 * 60 * 60
+MAX_CHANGES = 1000
+GAP_TIMEOUT = 10
+CHUNK_SIZE = 50000
+
+logger = logging.getLogger(__name__)
+
+_pending = local()
+
+
+def load_pairs(queryset, fields=('recipe_id', 'ingredient_id')):
+    """Читает пары (рецепт, ингредиент) в массивы NumPy частями."""
+    rows = queryset.values_list(*fields).iterator(
+        chunk_size=CHUNK_SIZE
+    )
+    chunks = [np.zeros((0, 2), dtype=np.int32)]
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        chunks.append(np.array(chunk, dtype=np.int32))
+    pairs = np.concatenate(chunks)
+    return pairs[:, 0], pairs[:, 1]
+
+
+class RecipeIngredientIndexCache:
+    """Индекс ингредиентов рецептов в памяти процесса.
+
+    Изменения рецептов записываются в общий кэш Django как журнал:
+    номер изменения и список id рецептов. Перед запросом процесс
+    дочитывает журнал и перечитывает из базы ингредиенты только этих
+    рецептов. Номер выдается раньше, чем появляется запись, поэтому
+    пропущенная запись сначала ждет GAP_TIMEOUT секунд. Если журнал
+    прерывается, отстал слишком сильно или сменилось поколение, индекс
+    строится заново в фоновом потоке, а запросы до конца сборки
+    обслуживает текущий индекс. Запрос ждет сборки, только если индекса
+    в процессе еще нет.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._generation = None
+        self._sequence = 0
+        self._gap_since = None
+        self._rebuilding = False
+        self._lock = Lock()
+
+    def invalidate(self):
+        cache.set(GENERATION_KEY, uuid4().hex, None)
+
+    def build(self):
+        queryset = IngredientInRecipe.objects.using(DEFAULT_DB_ALIAS)
+        return RecipeIngredientIndex(*load_pairs(queryset))
+
+    def read_changes(self, sequence):
+        """Возвращает номер последней записи журнала, прочитанной подряд
+        после текущей, и id рецептов из прочитанных записей."""
+        keys = [
+            CHANGES_KEY.format(sequence=number)
+            for number in range(self._sequence + 1, sequence + 1)
+        ]
+        changes = cache.get_many(keys)
+        read, recipe_ids = self._sequence, set()
+        for key in keys:
+            if key not in changes:
+                break
+            read += 1
+            recipe_ids.update(changes[key])
+        return read, recipe_ids
+
+    def load(self):
+        state = cache.get_many((GENERATION_KEY, SEQUENCE_KEY))
+        generation = state.get(GENERATION_KEY)
+        if generation is None:
+            generation = cache.get_or_set(GENERATION_KEY, uuid4().hex, None)
+        sequence = state.get(SEQUENCE_KEY, 0)
+        with self._lock:
+            if self._index is None:
+                self._index = self.build()
+                self._generation, self._sequence = generation, sequence
+            elif self._rebuilding:
+                pass
+            elif (generation != self._generation
+                  or not self._sequence <= sequence
+                  <= self._sequence + MAX_CHANGES):
+                self.rebuild(generation, sequence)
+            elif sequence != self._sequence:
+                self.apply_changes(generation, sequence)
+            return self._index
+
+    def apply_changes(self, generation, sequence):
+        read, recipe_ids = self.read_changes(sequence)
+        if recipe_ids:
+            self._index.update(recipe_ids, *load_pairs(
+                IngredientInRecipe.objects.using(
+                    DEFAULT_DB_ALIAS
+                ).filter(recipe_id__in=recipe_ids)
+            ))
+        self._sequence = read
+        if read == sequence:
+            self._gap_since = None
+        elif self._gap_since is None:
+            self._gap_since = monotonic()
+        elif monotonic() - self._gap_since > GAP_TIMEOUT:
+            self.rebuild(generation, sequence)
+
+    def rebuild(self, generation, sequence):
+        """Запускает сборку индекса в фоновом потоке."""
+        self._rebuilding = True
+        Thread(
+            target=self._rebuild, args=(generation, sequence), daemon=True
+        ).start()
+
+    def _rebuild(self, generation, sequence):
+        try:
+            index = self.build()
+        except Exception:
+            logger.exception('Не удалось пересобрать индекс ингредиентов')
+            index = None
+        finally:
+            connections.close_all()
+        with self._lock:
+            if index is not None:
+                # Записи журнала до sequence сделаны после фиксации своих
+                # транзакций, поэтому уже видны в прочитанных парах.
+                self._index = index
+                self._generation, self._sequence = generation, sequence
+                self._gap_since = None
+            self._rebuilding = False
+
+    def record(self, recipe_ids):
+        """Добавляет изменение в журнал под следующим свободным номером."""
+        recipe_ids = sorted(recipe_ids)
+        while True:
+            try:
+                sequence = cache.incr(SEQUENCE_KEY)
+            except ValueError:
+                cache.add(SEQUENCE_KEY, 0, None)
+                continue
+            if cache.add(
+                CHANGES_KEY.format(sequence=sequence), recipe_ids,
+                CHANGES_TIMEOUT
+            ):
+                return
+
+
+recipe_ingredient_index = RecipeIngredientIndexCache()
+
+
+def schedule_index_update(recipe_ids):
+    """Откладывает запись изменений до фиксации транзакции, собирая все
+    рецепты транзакции в одну запись журнала."""
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids = set()
+    _pending.recipe_ids.update(recipe_ids)
+    transaction.on_commit(flush_index_updates)
+
+
+def flush_index_updates():
+    recipe_ids, _pending.recipe_ids = _pending.recipe_ids, set()
+    if recipe_ids:
+        recipe_ingredient_index.record(recipe_ids)
+
+
+class RankedRecipes:
+    """Страница ранжированных id в виде рецептов из queryset.
+
+    Id можно передать и запросом values_list: тогда число рецептов
+    считается через COUNT(*), а страница читается с LIMIT и OFFSET.
+    """
+
+    def __init__(self, matches, queryset):
+        self.matches = matches
+        self.queryset = queryset
+
+    def __len__(self):
+        return len(self.matches)
+
+    def count(self):
+        if isinstance(self.matches, QuerySet):
+            return self.matches.count()
+        return len(self.matches)
+
+    def __getitem__(self, page):
+        recipe_ids = list(self.matches[page])
+        recipes = self.queryset.in_bulk(recipe_ids)
+        return [recipes[pk] for pk in recipe_ids if pk in recipes]
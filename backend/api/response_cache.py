@@ -0,0 +1,174 @@
+from collections import Counter
+from hashlib import md5
+from threading import local
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+
+from recipes.models import Recipe
+
+from .catalogue import ingredient_catalogue, tag_catalogue
+from .metrics import ProcessMetrics
+
+LIST_VERSION_KEY = 'recipe_responses:list:{scope}:version'
+RECIPE_VERSION_KEY = 'recipe_responses:recipe:{recipe_id}:version'
+RESPONSE_KEY = 'recipe_responses:{action}:{digest}'
+HITS_KEY = 'recipe_responses:hits'
+MISSES_KEY = 'recipe_responses:misses'
+STATS_KEY = 'recipe_responses:stats'
+BYPASS_HEADER = 'X-Cache-Bypass'
+CACHEABLE_PARAMS = ('author', 'cursor', 'limit', 'page', 'tags')
+
+_pending = local()
+
+
+def normalize_query(query_params):
+    """Приводит параметры запроса к каноническому виду.
+
+    Возвращает None, если в запросе есть параметры, ответ на которые
+    не кэшируется, например сортировка по счетчикам избранного.
+    """
+    if set(query_params) - set(CACHEABLE_PARAMS):
+        return None
+    return '&'.join(
+        f'{param}={value}'
+        for param in CACHEABLE_PARAMS
+        for value in sorted(set(query_params.getlist(param)))
+    )
+
+
+def get_versions(keys):
+    """Читает версии одним запросом к общему кэшу, создавая недостающие."""
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def response_key(action, host, query, scope_key):
+    versions = get_versions([
+        scope_key, tag_catalogue.version_key, ingredient_catalogue.version_key
+    ])
+    digest = md5(
+        '|'.join([host, query, *versions]).encode()
+    ).hexdigest()
+    return RESPONSE_KEY.format(action=action, digest=digest)
+
+
+def list_key(request, query):
+    author = request.GET.get('author', '')
+    scope = f'author:{author}' if author.isdigit() else 'all'
+    return response_key(
+        'list', request.get_host(), query,
+        LIST_VERSION_KEY.format(scope=scope)
+    )
+
+
+def detail_key(request, recipe_id):
+    return response_key(
+        'detail', request.get_host(), '',
+        RECIPE_VERSION_KEY.format(recipe_id=recipe_id)
+    )
+
+
+def get_response_data(key):
+    data = caches['responses'].get(key)
+    increment(MISSES_KEY if data is None else HITS_KEY)
+    return data
+
+
+def peek_response_data(key):
+    """Читает ответ, считая только попадания: промах дальше обработает
+    синхронное представление, которое и учтет его."""
+    data = caches['responses'].get(key)
+    if data is not None:
+        increment(HITS_KEY)
+    return data
+
+
+def set_response_data(key, data):
+    caches['responses'].set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+
+
+class StatsCounter(ProcessMetrics):
+    """Счетчики попаданий и промахов кэша ответов.
+
+    Процесс копит их в памяти и публикует в кэш metrics, поэтому запрос
+    не обращается к общему кэшу ради статистики.
+    """
+
+    key = STATS_KEY
+
+    def __init__(self):
+        super().__init__()
+        self._counts = Counter()
+
+    def collect(self, key):
+        self._counts[key] += 1
+
+    def state(self):
+        return dict(self._counts)
+
+
+stats_counter = StatsCounter()
+
+
+def increment(key):
+    stats_counter.add(key)
+
+
+def get_stats():
+    stats = Counter()
+    for state in StatsCounter.load_states():
+        stats.update(state)
+    return stats[HITS_KEY], stats[MISSES_KEY]
+
+
+def purge(recipe_ids=(), author_ids=()):
+    """Сбрасывает карточки рецептов, общую ленту и ленты авторов."""
+    cache.delete_many(
+        [LIST_VERSION_KEY.format(scope='all')]
+        + [LIST_VERSION_KEY.format(scope=f'author:{author_id}')
+           for author_id in set(author_ids)]
+        + [RECIPE_VERSION_KEY.format(recipe_id=recipe_id)
+           for recipe_id in set(recipe_ids)]
+    )
+
+
+def schedule_purge(recipe_ids=(), author_ids=()):
+    """Откладывает сброс до фиксации транзакции.
+
+    Изменения строк одного рецепта копятся в наборе, поэтому авторы
+    рецептов определяются одним запросом на всю транзакцию.
+    """
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids, _pending.author_ids = set(), set()
+    _pending.recipe_ids.update(recipe_ids)
+    _pending.author_ids.update(author_ids)
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    recipe_ids, author_ids = _pending.recipe_ids, _pending.author_ids
+    if not recipe_ids and not author_ids:
+        return
+    _pending.recipe_ids, _pending.author_ids = set(), set()
+    if recipe_ids:
+        author_ids.update(Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('author_id', flat=True).distinct())
+    purge(recipe_ids, author_ids)
+
+
+def purge_author(author_id):
+    """Сбрасывает все ответы, в которых показан профиль автора."""
+    schedule_purge(
+        Recipe.objects.filter(author_id=author_id).values_list(
+            'id', flat=True
+        ),
+        (author_id, )
+    )
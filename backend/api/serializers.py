@@ -1,15 +1,22 @@
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from recipes.constant import MIN_VALUE, MAX_VALUE
+from recipes.constant import (MAX_BULK_RECIPES, MAX_PANTRY_INGREDIENTS,
+                              MAX_VALUE, MIN_VALUE)
+from recipes.images import DERIVATIVE_FORMATS
 from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag, TagInRecipe)
+                            ShoppingCart, ShoppingListItem, Tag, TagInRecipe)
 from users.models import Subscribe
 
+from .catalogue import ingredient_catalogue, tag_catalogue
+from .fields import StreamingBase64ImageField
+from .shopping_list import schedule_cart_versions_bump
+
 
 User = get_user_model()
 
@@ -23,6 +30,54 @@ class CustomUserCreateSerializer(UserCreateSerializer):
                   'last_name', 'password')
 
 
+class CatalogueRelatedField(serializers.PrimaryKeyRelatedField):
+    """Поле первичного ключа, проверяемое по кэшу справочника."""
+
+    catalogue = None
+
+    def to_internal_value(self, data):
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = self.catalogue.load().objects.get(pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class IngredientRelatedField(CatalogueRelatedField):
+    catalogue = ingredient_catalogue
+
+
+class TagRelatedField(CatalogueRelatedField):
+    catalogue = tag_catalogue
+
+
+class ImageSrcsetField(serializers.Field):
+    """srcset уменьшенных копий картинки рецепта для каждого формата."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'image_variants')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        srcset = {}
+        for image_format in DERIVATIVE_FORMATS:
+            urls = (
+                (width, default_storage.url(name))
+                for width, name in variants.get(image_format, ())
+            )
+            srcset[image_format] = ', '.join(
+                f'{request.build_absolute_uri(url) if request else url} '
+                f'{width}w'
+                for width, url in urls
+            )
+        return srcset
+
+
 class ProfileSerializer(UserSerializer):
     """Сериализатор для отображения пользователя."""
 
@@ -36,6 +91,8 @@ class ProfileSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if user and not user.is_anonymous:
             return Subscribe.objects.filter(
@@ -84,15 +141,19 @@ class RecipeListSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
+            'is_in_shopping_cart', 'name', 'image', 'srcset', 'text',
+            'cooking_time',
         )
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -100,6 +161,8 @@ class RecipeListSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -110,7 +173,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
 class AddIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для добавления ингредиентов."""
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = IngredientRelatedField(queryset=Ingredient.objects.all())
     amount = serializers.IntegerField(
         validators=(
             MinValueValidator(
@@ -133,9 +196,9 @@ class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для создания рецепта."""
 
     author = ProfileSerializer(read_only=True)
-    image = Base64ImageField()
+    image = StreamingBase64ImageField()
     ingredients = AddIngredientSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = TagRelatedField(
         queryset=Tag.objects.all(),
         many=True
     )
@@ -195,55 +258,109 @@ class RecipeSerializer(serializers.ModelSerializer):
         return value
 
     @staticmethod
-    def create_ingredients(ingredients, recipe):
-        ingredients_list = [
+    def set_ingredients(ingredients, recipe, existing=()):
+        """Приводит ингредиенты рецепта к переданному списку.
+
+        Сравнивает их с текущими строками IngredientInRecipe: неизменные
+        строки остаются как есть, у остальных обновляется количество,
+        лишние удаляются, недостающие создаются. Разница переносится
+        в списки покупок, где лежит рецепт; удаление строк учитывает
+        сигнал post_delete.
+        """
+        current = {item.ingredient_id: item for item in existing}
+        amounts = {
+            ingredient['id'].pk: ingredient['amount']
+            for ingredient in ingredients
+        }
+        before = {
+            ingredient_id: item.amount
+            for ingredient_id, item in current.items()
+            if ingredient_id in amounts
+        }
+        to_update = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != item.amount:
+                item.amount = amount
+                to_update.append(item)
+        to_delete = [
+            item.pk for ingredient_id, item in current.items()
+            if ingredient_id not in amounts
+        ]
+        if to_delete:
+            IngredientInRecipe.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            IngredientInRecipe.objects.bulk_update(to_update, ('amount', ))
+        IngredientInRecipe.objects.bulk_create(
             IngredientInRecipe(
                 recipe=recipe,
-                ingredient=ingredient['id'],
-                amount=ingredient['amount']
-            ) for ingredient in ingredients
-        ]
-        IngredientInRecipe.objects.bulk_create(ingredients_list)
+                ingredient_id=ingredient_id,
+                amount=amount
+            ) for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        )
+        if current:
+            ShoppingListItem.objects.apply_recipe_changes(
+                recipe.pk, before, amounts
+            )
 
     @staticmethod
-    def create_tags(tags, recipe):
-        tags_list = [
-            TagInRecipe(
-                recipe=recipe,
-                tag=tag,
-            ) for tag in tags
+    def set_tags(tags, recipe, existing=()):
+        current = {item.tag_id: item for item in existing}
+        tag_ids = {tag.pk for tag in tags}
+        to_delete = [
+            item.pk for tag_id, item in current.items()
+            if tag_id not in tag_ids
         ]
-        TagInRecipe.objects.bulk_create(tags_list)
+        if to_delete:
+            TagInRecipe.objects.filter(pk__in=to_delete).delete()
+        TagInRecipe.objects.bulk_create(
+            TagInRecipe(recipe=recipe, tag_id=tag_id)
+            for tag_id in tag_ids if tag_id not in current
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        self.create_ingredients(ingredients, recipe)
-        self.create_tags(tags, recipe)
+        self.set_ingredients(ingredients, recipe)
+        self.set_tags(tags, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        instance.ingredients.clear()
-        self.create_ingredients(ingredients, instance)
-        instance.tags.clear()
-        self.create_tags(tags, instance)
+        self.set_ingredients(
+            ingredients, instance, instance.recipe_ingredients.all()
+        )
+        self.set_tags(tags, instance, TagInRecipe.objects.filter(
+            recipe=instance
+        ))
+        schedule_cart_versions_bump((instance.pk, ))
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipe.objects.with_user_flags(
+            request.user
+        ).prefetch_related(
+            'recipe_ingredients__ingredient', 'tags'
+        ).get(pk=instance.pk)
         return RecipeListSerializer(
-            instance, context={'request': self.context.get('request')}
+            instance, context={'request': request}
         ).data
 
 
 class SubscribeRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для отображения краткой информации рецептов."""
 
+    srcset = ImageSrcsetField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'srcset', 'cooking_time')
 
 
 class SubscribeListSerializer(ProfileSerializer):
@@ -273,15 +390,60 @@ class SubscribeListSerializer(ProfileSerializer):
         return data
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[: int(limit)]
+        recipes = getattr(obj, 'recipes_preview', None)
+        if recipes is None:
+            limit = self.context.get('recipes_limit')
+            recipes = obj.recipes.order_by('-id')[:limit]
         serializer = SubscribeRecipeSerializer(
             recipes, many=True, read_only=True
         )
         return serializer.data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
+
+
+class RecipesLimitSerializer(serializers.Serializer):
+    """Сериализатор для проверки параметра recipes_limit."""
+
+    recipes_limit = serializers.IntegerField(
+        min_value=0,
+        required=False,
+        default=None
+    )
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Сериализатор для списка id рецептов в массовых операциях."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES
+    )
+
+    def validate_recipes(self, recipes):
+        return list(dict.fromkeys(recipes))
+
+
+class PantrySerializer(serializers.Serializer):
+    """Сериализатор для списка доступных пользователю ингредиентов."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_PANTRY_INGREDIENTS
+    )
+
+
+class ShoppingListSerializer(serializers.Serializer):
+    """Сериализатор для строк суммарного списка покупок."""
+
+    id = serializers.IntegerField(source='ingredient_id')
+    name = serializers.CharField(source='ingredient__name')
+    measurement_unit = serializers.CharField(
+        source='ingredient__measurement_unit'
+    )
+    amount = serializers.IntegerField()
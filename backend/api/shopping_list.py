@@ -0,0 +1,206 @@
+import csv
+from io import BytesIO, StringIO
+from threading import local
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.negotiation import DefaultContentNegotiation
+
+from recipes.models import ShoppingCart, ShoppingListItem
+
+from .catalogue import ingredient_catalogue
+
+TITLE = 'Cписок покупок:'
+CART_VERSION_KEY = 'shopping_cart:{user_id}:version'
+EXPORT_KEY = 'shopping_list:{user_id}:{version}:{catalogue}:{format}'
+
+_pending = local()
+
+
+def get_cart_version(user_id):
+    return cache.get_or_set(
+        CART_VERSION_KEY.format(user_id=user_id), uuid4().hex, None
+    )
+
+
+def bump_cart_versions(user_ids):
+    """Сбрасывает сохраненные списки покупок указанных пользователей."""
+    cache.set_many(
+        {CART_VERSION_KEY.format(user_id=user_id): uuid4().hex
+         for user_id in set(user_ids)},
+        None
+    )
+
+
+def bump_recipe_cart_versions(recipe_ids):
+    """Сбрасывает списки покупок всех, у кого рецепты лежат в корзине."""
+    bump_cart_versions(ShoppingCart.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('user_id', flat=True))
+
+
+def schedule_cart_versions_bump(recipe_ids):
+    """Откладывает сброс списков покупок до фиксации транзакции, собирая
+    все рецепты транзакции в один запрос."""
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids = set()
+    _pending.recipe_ids.update(recipe_ids)
+    transaction.on_commit(flush_cart_versions_bump)
+
+
+def flush_cart_versions_bump():
+    recipe_ids, _pending.recipe_ids = _pending.recipe_ids, set()
+    if recipe_ids:
+        bump_recipe_cart_versions(recipe_ids)
+
+
+def get_shopping_list(user):
+    """Читает готовый суммарный список покупок пользователя."""
+    return ShoppingListItem.objects.filter(user=user).values(
+        'ingredient_id',
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'amount'
+    ).order_by('ingredient__name').using(DEFAULT_DB_ALIAS)
+
+
+class ShoppingListExporter:
+    """Базовый формат выгрузки списка покупок.
+
+    Наследники задают формат, тип содержимого и метод render, который
+    по частям отдает байты файла.
+    """
+
+    format = None
+    content_type = None
+
+    def render(self, rows):
+        raise NotImplementedError
+
+
+class TextExporter(ShoppingListExporter):
+    format = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+
+    def render(self, rows):
+        yield TITLE.encode()
+        for row in rows:
+            yield (
+                f'\n{row["ingredient__name"]} - {row["amount"]} '
+                f'{row["ingredient__measurement_unit"]}'
+            ).encode()
+
+
+class CsvExporter(ShoppingListExporter):
+    format = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+
+    def render(self, rows):
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')
+        writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+        for row in rows:
+            writer.writerow((
+                row['ingredient__name'],
+                row['amount'],
+                row['ingredient__measurement_unit'],
+            ))
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode()
+
+
+class PdfExporter(ShoppingListExporter):
+    format = 'pdf'
+    content_type = 'application/pdf'
+    font_name = 'ShoppingListFont'
+
+    def render(self, rows):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_LIST_PDF_FONT)
+            )
+        buffer = BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        width, height = A4
+        margin, line_height = 50, 18
+        pdf.setFont(self.font_name, 16)
+        pdf.drawString(margin, height - margin, TITLE)
+        y = height - margin - 2 * line_height
+        pdf.setFont(self.font_name, 12)
+        for row in rows:
+            if y < margin:
+                pdf.showPage()
+                pdf.setFont(self.font_name, 12)
+                y = height - margin
+            pdf.drawString(
+                margin, y,
+                f'{row["ingredient__name"]} - {row["amount"]} '
+                f'{row["ingredient__measurement_unit"]}'
+            )
+            y -= line_height
+        pdf.save()
+        yield buffer.getvalue()
+
+
+EXPORTERS = {
+    exporter.format: exporter
+    for exporter in (TextExporter, CsvExporter, PdfExporter)
+}
+
+
+class ExportContentNegotiation(DefaultContentNegotiation):
+    """Не дает DRF трактовать параметр format как формат рендерера."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def shopping_list_response(user, exporter):
+    """Отдает список покупок потоком, сохраняя результат в кэше.
+
+    Ключ кэша включает версию корзины пользователя и версию справочника
+    ингредиентов, поэтому изменение корзины, ингредиентов рецептов из нее
+    или самих ингредиентов приводит к новой выгрузке.
+    """
+    key = EXPORT_KEY.format(
+        user_id=user.pk,
+        version=get_cart_version(user.pk),
+        catalogue=ingredient_catalogue.get_version(),
+        format=exporter.format,
+    )
+    content = cache.get(key)
+    if content is not None:
+        chunks = iter((content, ))
+    else:
+        rows = get_shopping_list(user).iterator()
+        chunks = caching_chunks(key, exporter().render(rows))
+        if settings.ASGI_MODE:
+            # Django 3.2 перебирает потоковый ответ ASGI в цикле событий,
+            # где обращения к базе запрещены, поэтому файл собирается
+            # целиком в потоке представления.
+            chunks = iter((b''.join(chunks), ))
+    response = StreamingHttpResponse(
+        chunks, content_type=exporter.content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping_list.{exporter.format}"'
+    )
+    return response
+
+
+def caching_chunks(key, chunks):
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(parts), settings.SHOPPING_LIST_CACHE_TIMEOUT)
@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.images import image_processed
+from recipes.models import (Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag, TagInRecipe, User,
+                            user_recipes_added, user_recipes_removed)
+
+from .catalogue import ingredient_catalogue, tag_catalogue
+from .pantry import schedule_index_update
+from .response_cache import purge_author, schedule_purge
+from .shopping_list import bump_cart_versions, schedule_cart_versions_bump
+
+PROFILE_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tag_catalogue(sender, **kwargs):
+    transaction.on_commit(tag_catalogue.invalidate)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_catalogue(sender, **kwargs):
+    transaction.on_commit(ingredient_catalogue.invalidate)
+
+
+@receiver((user_recipes_added, user_recipes_removed), sender=ShoppingCart)
+def invalidate_shopping_list(sender, user_id, **kwargs):
+    bump_cart_versions((user_id, ))
+
+
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+def invalidate_recipe_shopping_lists(sender, instance, **kwargs):
+    schedule_cart_versions_bump((instance.recipe_id, ))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def purge_recipe_responses(sender, instance, **kwargs):
+    schedule_purge((instance.pk, ), (instance.author_id, ))
+
+
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+@receiver((post_save, post_delete), sender=TagInRecipe)
+def purge_recipe_relation_responses(sender, instance, **kwargs):
+    schedule_purge((instance.recipe_id, ))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+def update_recipe_ingredient_index(sender, instance, **kwargs):
+    recipe_id = instance.pk if sender is Recipe else instance.recipe_id
+    schedule_index_update((recipe_id, ))
+
+
+@receiver(image_processed, sender=Recipe)
+def purge_recipe_image_responses(sender, recipe_id, **kwargs):
+    schedule_purge((recipe_id, ))
+
+
+@receiver(post_save, sender=User)
+def purge_author_responses(sender, instance, created, update_fields,
+                           **kwargs):
+    if created or (
+        update_fields is not None
+        and not set(update_fields) & set(PROFILE_FIELDS)
+    ):
+        return
+    purge_author(instance.pk)
@@ -0,0 +1,729 @@
+from collections import defaultdict
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, router
+from django.db.models import Sum
+from django.test import (AsyncClient, RequestFactory, TestCase,
+                         override_settings)
+from django.urls import path
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api import async_views
+from api.management.commands.score_trending import Command as ScoreTrending
+
+from api.middleware import ReplicaRoutingMiddleware
+from api.metrics import (EndpointStats, SlowestSamples, histogram_percentile,
+                         load_endpoint_stats, load_samples)
+
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, SimilarRecipe, Tag,
+                            TagInRecipe, TrendingCheckpoint, TrendingRecipe)
+from foodgram.db_router import REPLICA_DB_ALIAS
+from users.models import CustomUser, Subscribe
+
+RECIPE_LIST_QUERIES = 6
+RECIPE_UPDATE_QUERIES = 17
+
+
+class RecipeApiTestCase(TestCase):
+    """Общие данные: пользователи, теги и ингредиенты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            CustomUser.objects.create(
+                email=f'user{number}@example.com',
+                username=f'user{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+            ) for number in range(5)
+        ]
+        cls.user = cls.users[0]
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', slug=f'tag{number}',
+                color=f'#00000{number}'
+            ) for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number:02}', measurement_unit='г'
+            ) for number in range(40)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @classmethod
+    def create_recipe(cls, author, ingredients):
+        recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=10, author=author,
+            image='recipes/images/recipe.png'
+        )
+        TagInRecipe.objects.create(recipe=recipe, tag=cls.tags[0])
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                recipe=recipe, ingredient=ingredient, amount=number + 1
+            ) for number, ingredient in enumerate(ingredients)
+        )
+        return recipe
+
+
+class RecipeListQueriesTest(RecipeApiTestCase):
+    """Флаги пользователя не добавляют запросов на каждый рецепт."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        recipes = [
+            cls.create_recipe(
+                cls.users[number % len(cls.users)],
+                cls.ingredients[number % 10:number % 10 + 3]
+            )
+            for number in range(25)
+        ]
+        Favorite.objects.bulk_create(
+            Favorite(user=cls.user, recipe=recipe) for recipe in recipes[::2]
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in recipes[::3]
+        )
+        Subscribe.objects.create(user=cls.user, author=cls.users[1])
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for limit in (5, 20):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(RECIPE_LIST_QUERIES):
+                    response = self.client.get(
+                        '/api/recipes/', {'limit': limit}
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_user_flags(self):
+        favorited = set(Favorite.objects.filter(
+            user=self.user
+        ).values_list('recipe_id', flat=True))
+        in_cart = set(ShoppingCart.objects.filter(
+            user=self.user
+        ).values_list('recipe_id', flat=True))
+        response = self.client.get('/api/recipes/', {'limit': 20})
+        for recipe in response.data['results']:
+            self.assertEqual(
+                recipe['is_favorited'], recipe['id'] in favorited
+            )
+            self.assertEqual(
+                recipe['is_in_shopping_cart'], recipe['id'] in in_cart
+            )
+            self.assertEqual(
+                recipe['author']['is_subscribed'],
+                recipe['author']['id'] == self.users[1].pk
+            )
+
+
+class RecipeUpdateTest(RecipeApiTestCase):
+    """Изменение рецепта затрагивает только изменившиеся строки связей."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe(self.user, self.ingredients[:30])
+        TagInRecipe.objects.create(recipe=self.recipe, tag=self.tags[1])
+
+    def patch(self, ingredients, tags):
+        return self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/',
+            {
+                'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': amount}
+                    for ingredient, amount in ingredients
+                ],
+                'tags': [tag.pk for tag in tags],
+            },
+            format='json'
+        )
+
+    def through_rows(self):
+        return (
+            dict(IngredientInRecipe.objects.filter(
+                recipe=self.recipe
+            ).values_list('ingredient_id', 'pk')),
+            dict(TagInRecipe.objects.filter(
+                recipe=self.recipe
+            ).values_list('tag_id', 'pk')),
+        )
+
+    def test_unchanged_rows_keep_primary_keys(self):
+        ingredients_before, tags_before = self.through_rows()
+        # Первые 20 ингредиентов без изменений, 5 с новым количеством,
+        # 5 удалены и 5 добавлены; первый тег остается, второй заменен.
+        ingredients = [
+            (ingredient, number + 1)
+            for number, ingredient in enumerate(self.ingredients[:20])
+        ] + [
+            (ingredient, 100) for ingredient in self.ingredients[20:25]
+        ] + [
+            (ingredient, 1) for ingredient in self.ingredients[30:35]
+        ]
+        response = self.patch(ingredients, (self.tags[0], self.tags[2]))
+        self.assertEqual(response.status_code, 200)
+        ingredients_after, tags_after = self.through_rows()
+        for ingredient in self.ingredients[:25]:
+            self.assertEqual(
+                ingredients_after[ingredient.pk],
+                ingredients_before[ingredient.pk]
+            )
+        self.assertEqual(
+            set(ingredients_after),
+            {ingredient.pk for ingredient, _ in ingredients}
+        )
+        self.assertEqual(
+            tags_after[self.tags[0].pk], tags_before[self.tags[0].pk]
+        )
+        self.assertEqual(set(tags_after), {self.tags[0].pk, self.tags[2].pk})
+        self.assertEqual(
+            dict(IngredientInRecipe.objects.filter(
+                recipe=self.recipe
+            ).values_list('ingredient_id', 'amount')),
+            {ingredient.pk: amount for ingredient, amount in ingredients}
+        )
+
+    def test_query_count_is_fixed(self):
+        # Первый запрос загружает справочники тегов и ингредиентов.
+        self.patch(
+            [(ingredient, 1) for ingredient in self.ingredients[:30]],
+            self.tags[:2]
+        )
+        for changed in (1, 30):
+            with self.subTest(changed=changed):
+                ingredients = [
+                    (ingredient, changed + 1 if number < changed else 1)
+                    for number, ingredient in enumerate(
+                        self.ingredients[:30]
+                    )
+                ]
+                with self.assertNumQueries(RECIPE_UPDATE_QUERIES):
+                    response = self.patch(ingredients, self.tags[:2])
+                self.assertEqual(response.status_code, 200)
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+        },
+        'metrics': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'metrics-tests',
+        },
+    },
+    REQUEST_METRICS_BUFFER_SIZE=5,
+)
+class RequestMetricsTest(TestCase):
+    """Сводки эндпоинтов не зависят от буфера самых медленных запросов."""
+
+    def test_fast_endpoint_keeps_its_percentiles(self):
+        workers = [EndpointStats(), EndpointStats()]
+        slowest = [SlowestSamples(), SlowestSamples()]
+        for number in range(200):
+            workers[number % 2].add({
+                'endpoint': 'GET tags', 'total_ms': 2 + number % 2,
+                'queries': 1, 'db_ms': 0.5,
+            })
+        for number in range(20):
+            record = {
+                'endpoint': 'GET recipes', 'total_ms': 300 + number,
+                'queries': 6, 'db_ms': 10, 'status': 200, 'app_ms': 5,
+            }
+            workers[number % 2].add(record)
+            slowest[number % 2].add(record)
+        for buffer in workers + slowest:
+            buffer.flush()
+        endpoints = load_endpoint_stats()
+        tags = endpoints['GET tags']
+        self.assertEqual(tags['count'], 200)
+        self.assertEqual(tags['queries'], 200)
+        self.assertLess(histogram_percentile(tags['histogram'], 95), 3.5)
+        self.assertEqual(endpoints['GET recipes']['count'], 20)
+        self.assertEqual(
+            [record['total_ms'] for record in load_samples()],
+            [319, 318, 317, 316, 315]
+        )
+
+
+class AsgiUrls:
+    """Маршруты рецептов режима ASGI для AsyncClient."""
+
+    urlpatterns = [
+        path('api/recipes/', async_views.recipe_list),
+        path('api/recipes/<int:pk>/', async_views.recipe_detail),
+    ]
+
+
+class ResponseCacheBypassTest(RecipeApiTestCase):
+    """Заголовок X-Cache-Bypass пропускает кэш ответов в обоих режимах."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipe = cls.create_recipe(cls.users[1], cls.ingredients[:3])
+
+    def setUp(self):
+        caches['responses'].clear()
+        self.anonymous = APIClient()
+
+    def test_wsgi_routes(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.anonymous.get(url)['X-Cache'], 'MISS')
+                self.assertEqual(self.anonymous.get(url)['X-Cache'], 'HIT')
+                response = self.anonymous.get(url, HTTP_X_CACHE_BYPASS='1')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['X-Cache'], 'BYPASS')
+
+    @override_settings(ROOT_URLCONF=AsgiUrls)
+    async def test_asgi_routes(self):
+        client = AsyncClient()
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/'):
+            with self.subTest(url=url):
+                self.assertEqual((await client.get(url))['X-Cache'], 'MISS')
+                self.assertEqual((await client.get(url))['X-Cache'], 'HIT')
+                response = await client.get(url, **{'X-Cache-Bypass': '1'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['X-Cache'], 'BYPASS')
+
+
+class ShoppingListTest(RecipeApiTestCase):
+    """Приращения списка покупок совпадают с пересчетом по корзинам."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.users[1]
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+        self.other_client = APIClient()
+        self.other_client.force_authenticate(self.users[2])
+        self.soup = self.create_recipe(self.author, self.ingredients[:4])
+        self.salad = self.create_recipe(self.author, self.ingredients[2:6])
+
+    def shopping_list(self):
+        return set(ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        ))
+
+    def summed(self):
+        """Список покупок так, как его раньше считала выгрузка."""
+        return {
+            (user.pk, row['ingredient'], row['amount'])
+            for user in self.users
+            for row in IngredientInRecipe.objects.filter(
+                recipe__shopping_cart__user=user
+            ).values('ingredient').annotate(amount=Sum('amount'))
+        }
+
+    def assert_consistent(self):
+        items = self.shopping_list()
+        self.assertEqual(items, self.summed())
+        counts = set(ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'recipes_count'
+        ))
+        ShoppingListItem.objects.rebuild([user.pk for user in self.users])
+        self.assertEqual(self.shopping_list(), items)
+        self.assertEqual(set(ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'recipes_count'
+        )), counts)
+
+    def update_recipe(self, recipe, ingredients):
+        response = self.author_client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {
+                'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+                'ingredients': [
+                    {'id': ingredient.pk, 'amount': amount}
+                    for ingredient, amount in ingredients
+                ],
+                'tags': [self.tags[0].pk],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_cart_and_recipe_changes(self):
+        for client, recipe in (
+            (self.client, self.soup), (self.client, self.salad),
+            (self.other_client, self.soup),
+        ):
+            response = client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+            self.assertEqual(response.status_code, 201)
+        self.assert_consistent()
+        self.assertTrue(self.shopping_list())
+
+        response = self.client.delete(
+            f'/api/recipes/{self.salad.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assert_consistent()
+        self.client.post(f'/api/recipes/{self.salad.pk}/shopping_cart/')
+
+        steps = (
+            # Изменено количество.
+            [(self.ingredients[0], 10), (self.ingredients[1], 2),
+             (self.ingredients[2], 3), (self.ingredients[3], 4)],
+            # Ингредиент заменен другим.
+            [(self.ingredients[0], 10), (self.ingredients[1], 2),
+             (self.ingredients[2], 3), (self.ingredients[7], 4)],
+            # Ингредиенты удалены и добавлены.
+            [(self.ingredients[0], 1), (self.ingredients[5], 6),
+             (self.ingredients[8], 2)],
+        )
+        for ingredients in steps:
+            with self.subTest(ingredients=ingredients):
+                self.update_recipe(self.soup, ingredients)
+                self.assert_consistent()
+
+        # Строка рецепта перенесена в другой рецепт через ORM.
+        item = IngredientInRecipe.objects.get(
+            recipe=self.soup, ingredient=self.ingredients[8]
+        )
+        item.recipe = self.salad
+        item.save()
+        self.assert_consistent()
+
+        response = self.author_client.delete(f'/api/recipes/{self.soup.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_consistent()
+        self.assertEqual(
+            {user_id for user_id, _, _ in self.shopping_list()},
+            {self.user.pk}
+        )
+
+
+class FeedTest(RecipeApiTestCase):
+    """Лента подписок совпадает с выборкой рецептов подписок."""
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def subscribe(self, user, author, method='post'):
+        response = getattr(self.client_for(user), method)(
+            f'/api/users/{author.pk}/subscribe/'
+        )
+        self.assertIn(response.status_code, (201, 204))
+
+    def assert_feed(self, user):
+        expected = list(Recipe.objects.filter(
+            author__following__user=user
+        ).order_by('-id').values_list('id', flat=True))
+        client = self.client_for(user)
+        url, pages, actual = '/api/recipes/feed/?limit=2', 0, []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            actual.extend(recipe['id'] for recipe in response.data['results'])
+            url, pages = response.data['next'], pages + 1
+        self.assertEqual(actual, expected)
+        self.assertEqual(pages, max(1, (len(expected) + 1) // 2))
+
+    @mock.patch('recipes.signals.FEED_FANOUT_LIMIT', 2)
+    @mock.patch('recipes.models.FEED_FANOUT_LIMIT', 2)
+    def test_fan_out_and_pull(self):
+        reader, author, other = self.users[0], self.users[1], self.users[2]
+        for recipe_author in (author, other, author, self.users[3]):
+            self.create_recipe(recipe_author, self.ingredients[:1])
+        self.subscribe(reader, author)
+        self.subscribe(reader, other)
+        self.assert_feed(reader)
+
+        # Подписчиков становится больше порога: рецепты автора
+        # дочитываются при чтении.
+        self.subscribe(self.users[3], author)
+        self.subscribe(self.users[4], author)
+        for recipe_author in (author, other, author):
+            self.create_recipe(recipe_author, self.ingredients[:1])
+        for user in (reader, self.users[3], self.users[4]):
+            with self.subTest(user=user, pulled=True):
+                self.assert_feed(user)
+
+        # Отписка возвращает автора под порог, его рецепты снова
+        # раскладываются по лентам.
+        self.subscribe(self.users[4], author, method='delete')
+        self.create_recipe(author, self.ingredients[:1])
+        for user in (reader, self.users[3], self.users[4]):
+            with self.subTest(user=user, pulled=False):
+                self.assert_feed(user)
+
+        self.subscribe(reader, other, method='delete')
+        self.assert_feed(reader)
+
+
+@mock.patch(
+    'api.management.commands.build_recommendations.SIMILAR_RECIPES_LIMIT', 3
+)
+class RecommendationsTest(RecipeApiTestCase):
+    """Пересчет по измененному избранному дает те же списки похожих
+    рецептов, что и полный."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipes = [
+            cls.create_recipe(cls.users[number % 5], cls.ingredients[:1])
+            for number in range(12)
+        ]
+        for number, user in enumerate(cls.users):
+            Favorite.objects.bulk_create(
+                Favorite(user=user, recipe=recipe)
+                for position, recipe in enumerate(cls.recipes)
+                if (number + 1) * (position + 2) % 7 < 3
+            )
+
+    def build(self, *args):
+        call_command('build_recommendations', *args, stdout=StringIO())
+        return set(SimilarRecipe.objects.values_list(
+            'recipe', 'similar', 'score'
+        ))
+
+    def toggle_favorite(self, user, recipe):
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f'/api/recipes/{recipe.pk}/favorite/'
+        if Favorite.objects.filter(user=user, recipe=recipe).exists():
+            self.assertEqual(client.delete(url).status_code, 204)
+        else:
+            self.assertEqual(client.post(url).status_code, 201)
+
+    def test_incremental_matches_full(self):
+        self.build('--full')
+        for user, recipe in (
+            (self.users[0], self.recipes[0]), (self.users[0], self.recipes[5]),
+            (self.users[2], self.recipes[3]), (self.users[3], self.recipes[0]),
+            (self.users[4], self.recipes[11]),
+        ):
+            self.toggle_favorite(user, recipe)
+        self.assertTrue(Recipe.objects.filter(similar_stale=True).exists())
+        incremental = self.build()
+        self.assertFalse(Recipe.objects.filter(similar_stale=True).exists())
+        self.assertEqual(incremental, self.build('--full'))
+        self.assertTrue(incremental)
+
+        lists, totals = defaultdict(set), defaultdict(float)
+        favorites = set(Favorite.objects.filter(
+            user=self.user
+        ).values_list('recipe', flat=True))
+        for recipe_id, similar_id, score in incremental:
+            lists[recipe_id].add(similar_id)
+            if recipe_id in favorites and similar_id not in favorites:
+                totals[similar_id] += score
+        for recipe in self.recipes:
+            with self.subTest(recipe=recipe.pk):
+                response = self.client.get(
+                    f'/api/recipes/{recipe.pk}/similar/'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    {row['id'] for row in response.data}, lists[recipe.pk]
+                )
+        response = self.client.get('/api/recipes/recommended/?limit=20')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row['id'] for row in response.data['results']],
+            sorted(totals, key=lambda pk: (-totals[pk], -pk))
+        )
+
+
+class TrendingTest(RecipeApiTestCase):
+    """Популярность, накопленная запусками по новым событиям, совпадает
+    с полным пересчетом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipes = [
+            cls.create_recipe(cls.users[0], cls.ingredients[:1])
+            for _ in range(6)
+        ]
+        cls.now = timezone.now()
+
+    def add_events(self, model, events, hours_ago):
+        """Добавляет события (пользователь, рецепт), каждое следующее
+        на час позже."""
+        for hour, (user, recipe) in enumerate(events):
+            event = model.objects.create(
+                user=self.users[user], recipe=self.recipes[recipe]
+            )
+            model.objects.filter(pk=event.pk).update(
+                created=self.now - timedelta(hours=hours_ago - hour)
+            )
+
+    def score(self, *args, hours_ago=0):
+        with mock.patch(
+            'django.utils.timezone.now',
+            return_value=self.now - timedelta(hours=hours_ago)
+        ):
+            call_command('score_trending', *args, stdout=StringIO())
+        return list(TrendingRecipe.objects.ranked_ids()), dict(
+            TrendingRecipe.objects.values_list('recipe_id', 'score')
+        )
+
+    def test_incremental_matches_full(self):
+        self.add_events(Favorite, ((0, 0), (1, 0), (2, 1), (0, 2)), 40)
+        self.add_events(ShoppingCart, ((0, 3), (1, 1)), 38)
+        self.score(hours_ago=30)
+        self.add_events(Favorite, ((3, 0), (3, 1), (4, 4)), 20)
+        self.add_events(ShoppingCart, ((2, 0), (3, 5)), 19)
+        self.score(hours_ago=10)
+        self.add_events(Favorite, ((4, 1), (1, 2)), 8)
+        self.add_events(ShoppingCart, ((4, 0), (2, 3), (1, 5)), 6)
+        ranked, scores = self.score()
+        self.assertEqual(len(ranked), len(self.recipes))
+
+        full_ranked, full_scores = self.score('--full')
+        self.assertEqual(ranked, full_ranked)
+        for recipe_id, score in full_scores.items():
+            self.assertAlmostEqual(scores[recipe_id], score, places=9)
+
+    def test_recipe_deleted_after_loading_events(self):
+        self.add_events(
+            Favorite, ((0, 0), (1, 0), (2, 1), (0, 2), (3, 4), (4, 5)), 10
+        )
+        self.add_events(ShoppingCart, ((0, 3), ), 2)
+        deleted = self.recipes[0]
+        load_events = ScoreTrending.load_events
+
+        def load_and_delete(command, since, until):
+            events = load_events(command, since, until)
+            deleted.delete()
+            return events
+
+        with mock.patch.object(ScoreTrending, 'load_events', load_and_delete):
+            ranked, _ = self.score()
+        connection.check_constraints()
+        self.assertNotIn(deleted.pk, ranked)
+        self.assertEqual(len(ranked), len(self.recipes) - 1)
+        self.assertTrue(TrendingCheckpoint.objects.exists())
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class ReplicaRoutingTest(TestCase):
+    """Чтение уходит на реплику, пока клиент ничего не записал."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.routed = []
+        with mock.patch.dict(settings.DATABASES, {REPLICA_DB_ALIAS: {}}):
+            self.middleware = ReplicaRoutingMiddleware(self.view)
+
+    def view(self, request):
+        self.routed.append(router.db_for_read(Recipe))
+        if request.method == 'POST':
+            router.db_for_write(Recipe)
+            self.routed.append(router.db_for_read(Recipe))
+        if request.path == '/login/':
+            request.session = SessionStore()
+            request.session.create()
+            self.session_key = request.session.session_key
+
+    def request(self, method='get', path='/', **extra):
+        self.routed.clear()
+        self.middleware(getattr(self.factory, method)(path, **extra))
+        return self.routed
+
+    def test_outside_request(self):
+        self.assertEqual(router.db_for_read(Recipe), DEFAULT_DB_ALIAS)
+
+    def test_write_pins_client_by_authorization(self):
+        client, other = (
+            {'HTTP_AUTHORIZATION': f'Token {token}'} for token in 'ab'
+        )
+        self.assertEqual(self.request(**client), [REPLICA_DB_ALIAS])
+        self.assertEqual(
+            self.request('post', **client),
+            [DEFAULT_DB_ALIAS, DEFAULT_DB_ALIAS]
+        )
+        self.assertEqual(self.request(**client), [DEFAULT_DB_ALIAS])
+        self.assertEqual(self.request(**other), [REPLICA_DB_ALIAS])
+        self.assertEqual(self.request(), [REPLICA_DB_ALIAS])
+
+    def test_write_pins_client_by_session(self):
+        self.assertEqual(self.request(path='/login/'), [REPLICA_DB_ALIAS])
+        self.factory.cookies[settings.SESSION_COOKIE_NAME] = self.session_key
+        self.assertEqual(self.request(), [DEFAULT_DB_ALIAS])
+        self.factory.cookies[settings.SESSION_COOKIE_NAME] = 'other'
+        self.assertEqual(self.request(), [REPLICA_DB_ALIAS])
+        self.request('post')
+        self.assertEqual(self.request(), [DEFAULT_DB_ALIAS])
+
+
+class IngredientSearchTest(RecipeApiTestCase):
+    """На SQLite поиск ингредиентов идет по индексу в памяти."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for name in ('Морская соль', 'Соль', 'Сольный сыр'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def search(self, name):
+        response = self.client.get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.data]
+
+    def test_prefix_matches_first(self):
+        self.search('соль')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.search('соль'), ['Соль', 'Сольный сыр', 'Морская соль']
+            )
+        self.assertEqual(
+            self.search('ент 1'),
+            [f'Ингредиент {number}' for number in range(10, 20)]
+        )
+        self.assertEqual(self.search('нет такого'), [])
+
+
+class CursorPaginationTest(RecipeApiTestCase):
+    """Режим курсора листает только по уникальному ключу сортировки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipes = [
+            cls.create_recipe(cls.users[0], cls.ingredients[:1])
+            for _ in range(7)
+        ]
+
+    def pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_unique_ordering(self):
+        self.assertEqual(
+            self.pages('/api/recipes/?cursor=&limit=3'),
+            [recipe.pk for recipe in reversed(self.recipes)]
+        )
+
+    def test_non_unique_ordering_rejected(self):
+        response = self.client.get(
+            '/api/recipes/?cursor=&ordering=-favorites_count'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/recipes/?ordering=-favorites_count')
+        self.assertEqual(response.status_code, 200)
@@ -1,5 +1,5 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import connections
+from django.db.models import Count, Exists, OuterRef, Prefetch, Value
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
@@ -10,44 +10,79 @@ from rest_framework.permissions import (AllowAny, IsAuthenticated,
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag, User)
+from recipes.constant import RECOMMENDED_RECIPES_LIMIT, SIMILAR_RECIPES_LIMIT
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            SimilarRecipe, Tag, TrendingRecipe, User)
 from users.models import Subscribe
 
-from .filters import IngredientSearchFilter, RecipeFilter
-from .pagination import CustomPagination
+from .catalogue import (ingredient_catalogue, search_ingredients,
+                        tag_catalogue)
+from .feed import Timeline
+from .filters import (IngredientSearchFilter, RecipeFilter,
+                      RecipeOrderingFilter)
+from .mixins import (AnonymousResponseCacheMixin, CatalogueMixin,
+                     MetricsMixin)
+from .pagination import (CustomPagination, FeedPagination,
+                         LimitPageNumberPagination)
+from .pantry import RankedRecipes, recipe_ingredient_index
 from .permissions import IsAuthorOrAdmin
-from .serializers import (IngredientSerializer, ProfileSerializer,
+from .serializers import (IngredientSerializer, PantrySerializer,
+                          ProfileSerializer, RecipeIdsSerializer,
                           RecipeListSerializer, RecipeSerializer,
+                          RecipesLimitSerializer, ShoppingListSerializer,
                           SubscribeListSerializer, SubscribeRecipeSerializer,
                           TagSerializer)
+from .shopping_list import (EXPORTERS, ExportContentNegotiation,
+                            get_shopping_list, shopping_list_response)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(MetricsMixin, CatalogueMixin, ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     permission_classes = (AllowAny, )
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend, )
     filterset_class = IngredientSearchFilter
+    catalogue = ingredient_catalogue
 
+    def is_filtered(self, request):
+        return bool(request.query_params.get('name'))
 
-class TagViewSet(ReadOnlyModelViewSet):
+    def list(self, request, *args, **kwargs):
+        """На PostgreSQL поиск по названию идет по индексам базы,
+        на остальных базах — по индексу названий снимка справочника."""
+        name = request.query_params.get('name')
+        if (not name or self.not_modified(request)
+                or connections[self.get_queryset().db].vendor
+                == 'postgresql'):
+            return super().list(request, *args, **kwargs)
+        results = search_ingredients(self.snapshot, name)
+        page = self.paginate_queryset(results)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(results)
+
+
+class TagViewSet(MetricsMixin, CatalogueMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     permission_classes = (AllowAny, )
     serializer_class = TagSerializer
+    catalogue = tag_catalogue
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(MetricsMixin, AnonymousResponseCacheMixin, ModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,
                           IsAuthorOrAdmin,)
-    filter_backends = (DjangoFilterBackend, )
+    filter_backends = (DjangoFilterBackend, RecipeOrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('favorites_count', 'shopping_cart_count')
+    ordering = ('-id', )
     pagination_class = CustomPagination
 
     def get_queryset(self):
-        queryset = Recipe.objects.all().select_related(
-            'author').prefetch_related(
-            'ingredients', 'tags'
+        queryset = Recipe.objects.with_user_flags(
+            self.request.user
+        ).prefetch_related(
+            'recipe_ingredients__ingredient', 'tags'
         ).order_by('-id')
         return queryset
 
@@ -60,26 +95,37 @@ class RecipeViewSet(ModelViewSet):
         return RecipeSerializer
 
     def add_to(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
+        recipe = get_object_or_404(Recipe, id=pk)
+        if not model.objects.add(user, (pk, )):
             return Response(
                 {'errors': 'Этот рецепт уже добавлен!'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
         serializer = SubscribeRecipeSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete_from(self, model, user, pk):
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
+        if model.objects.remove(user, (pk, )):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'errors': 'Этот рецепт уже удален!'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    def bulk_change(self, model, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'DELETE':
+            model.objects.remove(request.user, recipe_ids)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        created = model.objects.add(request.user, recipe_ids)
+        recipes = Recipe.objects.filter(
+            id__in=[obj.recipe_id for obj in created]
+        ).order_by('-id')
+        serializer = SubscribeRecipeSerializer(recipes, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(
         methods=['POST', 'DELETE'],
         detail=True,
@@ -111,39 +157,162 @@ class RecipeViewSet(ModelViewSet):
         return self.delete_from(ShoppingCart, request.user, pk)
 
     @action(
-        methods=['GET'],
+        methods=['POST', 'DELETE'],
         detail=False,
-        permission_classes=(IsAuthenticated, )
+        permission_classes=(IsAuthenticated, ),
+        url_path='favorite',
+        url_name='favorite-bulk'
     )
-    def download_shopping_cart(self, request):
-        ingredient_list = 'Cписок покупок:'
-
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-
-        for ingredient in ingredients:
-            ingredient_name = ingredient['ingredient__name']
-            measurement_unit = ingredient['ingredient__measurement_unit']
-            amount = ingredient['amount']
-            ingredient_list += (
-                f'\n{ingredient_name} - {amount} {measurement_unit}'
+    def bulk_favorite(self, request):
+        return self.bulk_change(Favorite, request)
+
+    @action(
+        methods=['GET', 'POST', 'DELETE'],
+        detail=False,
+        permission_classes=(IsAuthenticated, ),
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk'
+    )
+    def bulk_shopping_cart(self, request):
+        if request.method == 'GET':
+            serializer = ShoppingListSerializer(
+                get_shopping_list(request.user), many=True
             )
+            return Response(serializer.data)
+        return self.bulk_change(ShoppingCart, request)
 
-        file = 'shopping_list'
-        response = HttpResponse(ingredient_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(AllowAny, ),
+        pagination_class=LimitPageNumberPagination
+    )
+    def cookable(self, request):
+        """Рецепты из доступных ингредиентов: сначала те, для которых
+        есть большая доля ингредиентов."""
+        serializer = PantrySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        matches = recipe_ingredient_index.load().match(
+            serializer.validated_data['ingredients']
+        )
+        page = self.paginate_queryset(RankedRecipes(
+            matches, self.get_queryset()
+        ))
+        serializer = RecipeListSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
 
-        return response
+    @action(
+        methods=['GET'],
+        detail=True,
+        permission_classes=(AllowAny, )
+    )
+    def similar(self, request, pk):
+        """Рецепты, которые чаще всего добавляют в избранное вместе
+        с этим."""
+        try:
+            pk = int(pk)
+        except ValueError:
+            return Response(status=status.HTTP_404_NOT_FOUND)
 
+        get_object_or_404(Recipe, id=pk)
+        recipes = RankedRecipes(
+            SimilarRecipe.objects.similar_ids(pk, SIMILAR_RECIPES_LIMIT),
+            self.get_queryset()
+        )[:SIMILAR_RECIPES_LIMIT]
+        serializer = RecipeListSerializer(
+            recipes, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
 
-class CustomUserViewSet(UserViewSet):
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(IsAuthenticated, ),
+        pagination_class=LimitPageNumberPagination
+    )
+    def recommended(self, request):
+        """Рецепты, похожие на избранное пользователя."""
+        page = self.paginate_queryset(RankedRecipes(
+            SimilarRecipe.objects.recommended_ids(
+                request.user, RECOMMENDED_RECIPES_LIMIT
+            ),
+            self.get_queryset()
+        ))
+        serializer = RecipeListSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(AllowAny, ),
+        pagination_class=LimitPageNumberPagination
+    )
+    def trending(self, request):
+        """Рецепты по убыванию популярности за последние дни."""
+        page = self.paginate_queryset(RankedRecipes(
+            TrendingRecipe.objects.ranked_ids(), self.get_queryset()
+        ))
+        serializer = RecipeListSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(IsAuthenticated, ),
+        pagination_class=FeedPagination
+    )
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь, начиная
+        с новых."""
+        page = self.paginate_queryset(
+            Timeline(request.user, self.get_queryset())
+        )
+        serializer = RecipeListSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(IsAuthenticated, ),
+        content_negotiation_class=ExportContentNegotiation
+    )
+    def download_shopping_cart(self, request):
+        exporter = EXPORTERS.get(request.query_params.get('format', 'txt'))
+        if exporter is None:
+            return Response(
+                {'errors': 'Доступные форматы: ' + ', '.join(EXPORTERS)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return shopping_list_response(request.user, exporter)
+
+
+class CustomUserViewSet(MetricsMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = ProfileSerializer
     pagination_class = CustomPagination
+    cursor_ordering = ('username', )
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Subscribe.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        return queryset
+
+    def get_recipes_limit(self, request):
+        serializer = RecipesLimitSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes_limit']
 
     @action(
         detail=False,
@@ -171,7 +340,10 @@ class CustomUserViewSet(UserViewSet):
 
         if request.method == 'POST':
             serializer = SubscribeListSerializer(
-                author, data=request.data, context={'request': request}
+                author, data=request.data, context={
+                    'request': request,
+                    'recipes_limit': self.get_recipes_limit(request),
+                }
             )
             serializer.is_valid(raise_exception=True)
             Subscribe.objects.create(user=user, author=author)
@@ -194,7 +366,18 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = request.user
-        queryset = User.objects.filter(following__user=user)
+        limit = self.get_recipes_limit(request)
+        recipes = Recipe.objects.filter(
+            author__following__user=user
+        ).order_by('-id')
+        if limit is not None:
+            recipes = recipes.first_per_author(limit)
+        queryset = User.objects.filter(following__user=user).annotate(
+            recipes_count=Count('recipes'),
+            is_subscribed=Value(True),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='recipes_preview')
+        ).order_by('username')
         pages = self.paginate_queryset(queryset)
         serializer = SubscribeListSerializer(
             pages, many=True, context={'request': request}
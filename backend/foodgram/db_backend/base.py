@@ -0,0 +1,126 @@
+from collections import deque
+from threading import Lock
+from time import monotonic
+
+from django.db.backends.postgresql import base
+
+
+class ConnectionPool:
+    """Пул простаивающих соединений psycopg2 внутри процесса.
+
+    Не ограничивает число открытых соединений: если свободных нет,
+    открывается новое. Хранит не больше size простаивающих соединений
+    и закрывает те, что живут дольше max_age секунд.
+    """
+
+    def __init__(self, size, max_age):
+        self.size = size
+        self.max_age = max_age
+        self._idle = deque()
+        self._lock = Lock()
+
+    def get(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection, created_at = self._idle.pop()
+            if (self.max_age is None
+                    or monotonic() - created_at < self.max_age):
+                return connection, created_at
+            connection.close()
+
+    def put(self, connection, created_at):
+        if not connection.closed:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append((connection, created_at))
+                    return
+        connection.close()
+
+
+_pools = {}
+_pools_lock = Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с проверкой переиспользуемых соединений и пулом.
+
+    HEALTH_CHECKS: соединение, оставшееся с прошлого запроса или взятое
+    из пула, проверяется перед первым использованием в запросе.
+    POOL_SIZE: соединения возвращаются в общий пул процесса вместо
+    закрытия; полезен, когда запросы к базе выполняются в разных
+    потоках, каждый из которых живет недолго.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.pooled_at = None
+
+    @property
+    def pool(self):
+        size = self.settings_dict.get('POOL_SIZE')
+        if not size:
+            return None
+        with _pools_lock:
+            if self.alias not in _pools:
+                _pools[self.alias] = ConnectionPool(
+                    size, self.settings_dict.get('POOL_MAX_AGE')
+                )
+            return _pools[self.alias]
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        while pool is not None:
+            pooled = pool.get()
+            if pooled is None:
+                break
+            connection, created_at = pooled
+            if self.check_pooled(connection):
+                self.pooled_at = created_at
+                self.health_check_done = True
+                return connection
+            connection.close()
+        self.pooled_at = monotonic()
+        self.health_check_done = True
+        return super().get_new_connection(conn_params)
+
+    def check_pooled(self, connection):
+        if not self.settings_dict.get('HEALTH_CHECKS'):
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except base.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None or self.in_atomic_block:
+            return super()._close()
+        connection = self.connection
+        try:
+            if not connection.closed and not connection.autocommit:
+                connection.rollback()
+        except base.Database.Error:
+            return super()._close()
+        pool.put(connection, self.pooled_at)
+        return None
+
+    def ensure_connection(self):
+        if (self.connection is not None
+                and not self.health_check_done
+                and not self.in_atomic_block
+                and self.settings_dict.get('HEALTH_CHECKS')):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
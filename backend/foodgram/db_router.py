@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_DB_ALIAS = 'replica'
+# Токен или сессия, выданные только что, могут еще не дойти до реплики.
+PRIMARY_ONLY_MODELS = ('authtoken.token', 'sessions.session')
+
+routing_state = ContextVar('routing_state', default=None)
+
+
+class RoutingState:
+    """Состояние маршрутизации запросов к базе в рамках HTTP-запроса."""
+
+    def __init__(self, primary):
+        self.primary = primary
+        self.wrote = False
+
+
+class PrimaryReplicaRouter:
+    """Направляет чтение безопасных запросов на реплику.
+
+    После первой записи все следующие запросы к базе в том же
+    HTTP-запросе идут на основную базу. Вне HTTP-запросов, например
+    в командах и фоновых потоках, используется только основная база.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if (state is None or state.primary
+                or model._meta.label_lower in PRIMARY_ONLY_MODELS):
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.primary = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_primary():
+    """Временно направляет чтение на основную базу."""
+    state = routing_state.get()
+    if state is None:
+        yield
+        return
+    primary, state.primary = state.primary, True
+    try:
+        yield
+    finally:
+        state.primary = primary
@@ -11,6 +11,10 @@ SECRET_KEY = os.getenv('SECRET_KEY', 'secret_key')
 
 DEBUG = True
 
+# asgi: приложение запускается через uvicorn-воркеры gunicorn, а чтение
+# справочников и рецептов обслуживают асинхронные представления.
+ASGI_MODE = os.getenv('SERVER_MODE', 'wsgi') == 'asgi'
+
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', default='127.0.0.1, localhost').strip().split(', ')
 
 AUTH_USER_MODEL = 'users.CustomUser'
@@ -34,6 +38,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,17 +73,94 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 0))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.getenv('DB_ENGINE', 'foodgram.db_backend'),
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
         'PORT': os.getenv('DB_PORT', 5432),
+        # Соединения переживают запрос и проверяются перед первым
+        # использованием. В режиме ASGI Django 3.2 выполняет весь
+        # синхронный код процесса в одном потоке, поэтому постоянное
+        # соединение переиспользуется так же, как в режиме WSGI; пул
+        # процесса включается только явно через DB_POOL_SIZE.
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else DB_CONN_MAX_AGE,
+        'HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'true') == 'true',
+        'POOL_SIZE': DB_POOL_SIZE,
+        'POOL_MAX_AGE': DB_CONN_MAX_AGE,
     }
 }
 
+# Реплика для чтения. Безопасные запросы читают с нее, пока клиент
+# не записал что-нибудь в основную базу: после записи его запросы
+# REPLICA_STICKY_SECONDS секунд идут в основную базу. Движки баз
+# задаются в окружении, чтобы локально проверить маршрутизацию на двух
+# файлах SQLite.
+
+if os.getenv('REPLICA_DB_HOST') or os.getenv('REPLICA_DB_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'ENGINE': os.getenv(
+            'REPLICA_DB_ENGINE', DATABASES['default']['ENGINE']
+        ),
+        'NAME': os.getenv('REPLICA_DB_NAME', DATABASES['default']['NAME']),
+        'HOST': os.getenv('REPLICA_DB_HOST', DATABASES['default']['HOST']),
+        'PORT': os.getenv('REPLICA_DB_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['foodgram.db_router.PrimaryReplicaRouter']
+
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+
+
+# Cache
+# Файловый кэш общий для всех воркеров gunicorn на одном хосте, через него
+# воркеры узнают о новых версиях справочников.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')
+        ),
+        # Версии справочников и журнал индекса ингредиентов хранятся без
+        # срока, поэтому предел записей должен быть с запасом: при его
+        # превышении файловый кэш удаляет треть записей наугад.
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100_000)),
+        },
+    },
+    # Сводки эндпоинтов, самые медленные запросы и счетчики кэша ответов
+    # для request_metrics_report. Отдельный кэш, чтобы записи метрик
+    # не вытесняли ключи из default.
+    'metrics': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv(
+            'METRICS_CACHE_LOCATION', os.path.join(BASE_DIR, 'metrics_cache')
+        ),
+    },
+    # Ответы API для анонимных пользователей. Для общего кэша между
+    # воркерами укажите django_redis.cache.RedisCache и адрес Redis.
+    'responses': {
+        'BACKEND': os.getenv(
+            'RESPONSE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', 'responses'),
+    },
+}
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 60 * 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -121,6 +204,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/backend_media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Обработка картинок рецептов вне запроса: thread или process пул,
+# при нуле воркеров картинка обрабатывается сразу.
+
+IMAGE_PROCESSING_POOL = os.getenv('IMAGE_PROCESSING_POOL', 'thread')
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
@@ -147,3 +236,37 @@ DJOSER = {
         'user': ['api.permissions.IsCurrentUserOrAdmin'],
     }
 }
+
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Request metrics
+# Доля запросов, для которых собираются метрики SQL и времени обработки.
+
+REQUEST_METRICS_SAMPLE_RATE = float(
+    os.getenv('REQUEST_METRICS_SAMPLE_RATE', 0.1)
+)
+REQUEST_METRICS_BUFFER_SIZE = 1000
+REQUEST_METRICS_FLUSH_INTERVAL = 10
+REQUEST_METRICS_RETENTION = 24 * 60 * 60
+SLOW_REQUEST_THRESHOLD_MS = 500
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.metrics': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_METRICS_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
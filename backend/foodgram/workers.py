@@ -0,0 +1,21 @@
+import os
+
+from uvicorn.workers import UvicornWorker as BaseUvicornWorker
+
+
+class UvicornWorker(BaseUvicornWorker):
+    """uvicorn-воркер gunicorn с настройками из переменных окружения.
+
+    Django 3.2 не поддерживает протокол lifespan, поэтому он отключен.
+    UVICORN_LIMIT_CONCURRENCY ограничивает число одновременных
+    соединений воркера, сверх него клиенты получают 503.
+    """
+
+    CONFIG_KWARGS = {
+        'lifespan': 'off',
+        'limit_concurrency': (
+            int(os.environ['UVICORN_LIMIT_CONCURRENCY'])
+            if os.getenv('UVICORN_LIMIT_CONCURRENCY') else None
+        ),
+        'timeout_keep_alive': int(os.getenv('GUNICORN_KEEPALIVE', 5)),
+    }
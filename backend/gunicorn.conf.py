@@ -0,0 +1,24 @@
+import multiprocessing
+import os
+
+# SERVER_MODE=asgi запускает foodgram.asgi в uvicorn-воркерах: медленные
+# клиенты не занимают воркер целиком. Синхронный код Django 3.2 воркер
+# выполняет в одном потоке (sync_to_async с thread_sensitive=True), то есть
+# одновременно обслуживает один синхронный запрос, поэтому по умолчанию
+# воркеров столько, сколько потоков было бы у sync-воркеров.
+ASGI_MODE = os.getenv('SERVER_MODE', 'wsgi') == 'asgi'
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+workers = min(multiprocessing.cpu_count() * 2 + 1, 8)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+if ASGI_MODE:
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'foodgram.workers.UvicornWorker'
+    workers *= threads
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+
+workers = int(os.getenv('WEB_CONCURRENCY', workers))
@@ -38,9 +38,12 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', 'name', 'tags',)
     inlines = (IngredientsInLine, TagsInLine)
 
-    @display(description='Количество в избранных')
+    @display(
+        description='Количество в избранных',
+        ordering='favorites_count'
+    )
     def count_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
 
 @admin.register(IngredientInRecipe)
@@ -2,3 +2,17 @@ MAX_LENGTH = 200
 LENTH_COLOR = 7
 MIN_VALUE = 1
 MAX_VALUE = 10000
+MAX_BULK_RECIPES = 500
+MAX_PAGE_SIZE = 100
+IMAGE_WIDTHS = (320, 640, 1024)
+IMAGE_QUALITY = 82
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+MAX_IMAGE_SIDE = 8000
+MAX_IMAGE_PIXELS = 40_000_000
+MAX_PANTRY_INGREDIENTS = 100
+SIMILAR_RECIPES_LIMIT = 20
+RECOMMENDED_RECIPES_LIMIT = 100
+TRENDING_HALF_LIFE = 24 * 60 * 60
+TRENDING_MIN_SCORE = 0.1
+TRENDING_HORIZON = 30 * 24 * 60 * 60
+TRENDING_SETTLE_TIME = 60
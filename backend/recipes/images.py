@@ -0,0 +1,164 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from tempfile import mkstemp
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+from .constant import IMAGE_QUALITY, IMAGE_WIDTHS
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = 'recipes/images/derivatives'
+DERIVATIVE_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+# mkstemp создает файл с правами 0600, а картинки раздает nginx.
+FILE_MODE = 0o644
+
+image_processed = Signal()
+
+_executor = None
+_executor_lock = Lock()
+
+
+def to_rgb(image):
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def save_image(image, path, *args, **kwargs):
+    """Сохраняет картинку через временный файл в том же каталоге, чтобы
+    параллельные обработки не читали и не портили недописанный файл."""
+    directory, filename = os.path.split(path)
+    descriptor, tmp_path = mkstemp(prefix=f'.{filename}.', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            image.save(file, *args, **kwargs)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def render_variants(media_root, name, clean_source=True):
+    """Создает уменьшенные копии картинки.
+
+    Если clean_source, оригинал перекодируется без метаданных. Это
+    делается только при первой обработке загруженного файла: повторное
+    сжатие с потерями накапливало бы искажения. Работает только
+    с файлами, поэтому подходит и для пула процессов.
+    """
+    path = os.path.join(media_root, name)
+    with Image.open(path) as source:
+        image_format = source.format
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    if clean_source and image_format == 'JPEG':
+        save_image(
+            to_rgb(image), path, 'JPEG', quality=IMAGE_QUALITY,
+            optimize=True
+        )
+    elif clean_source:
+        save_image(image, path, image_format)
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    os.makedirs(os.path.join(media_root, DERIVATIVES_DIR), exist_ok=True)
+    widths = [width for width in IMAGE_WIDTHS if width < image.width]
+    variants = {'source': name}
+    for key, pil_format in DERIVATIVE_FORMATS.items():
+        variants[key] = []
+        for width in widths or [image.width]:
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.LANCZOS)
+            if pil_format == 'JPEG':
+                resized = to_rgb(resized)
+            variant = f'{DERIVATIVES_DIR}/{stem}_{width}.{key}'
+            save_image(
+                resized, os.path.join(media_root, variant), pil_format,
+                quality=IMAGE_QUALITY
+            )
+            variants[key].append((width, variant))
+    return variants
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            pool = (
+                ProcessPoolExecutor
+                if settings.IMAGE_PROCESSING_POOL == 'process'
+                else ThreadPoolExecutor
+            )
+            _executor = pool(settings.IMAGE_PROCESSING_WORKERS)
+        return _executor
+
+
+def variant_names(variants):
+    return {
+        variant for key in DERIVATIVE_FORMATS
+        for _, variant in variants.get(key, ())
+    }
+
+
+def delete_variants(variants, keep=()):
+    """Удаляет файлы уменьшенных копий, кроме перечисленных в keep."""
+    for variant in variant_names(variants) - variant_names(keep or {}):
+        default_storage.delete(variant)
+
+
+def save_variants(recipe_id, name, variants):
+    """Записывает копии в рецепт и после фиксации удаляет прежние.
+
+    Если картинку рецепта успели заменить, новые копии никому
+    не нужны и удаляются сразу.
+    """
+    with transaction.atomic():
+        previous = Recipe.objects.select_for_update().filter(
+            pk=recipe_id, image=name
+        ).values_list('image_variants', flat=True).first()
+        if previous is None:
+            transaction.on_commit(lambda: delete_variants(variants))
+            return
+        Recipe.objects.filter(pk=recipe_id).update(image_variants=variants)
+        transaction.on_commit(
+            lambda: delete_variants(previous, keep=variants)
+        )
+    image_processed.send(sender=Recipe, recipe_id=recipe_id)
+
+
+def process_image(recipe_id, name):
+    """Обрабатывает картинку рецепта в пуле воркеров.
+
+    Если IMAGE_PROCESSING_WORKERS равно нулю, обработка идет сразу
+    в текущем потоке.
+    """
+    if not settings.IMAGE_PROCESSING_WORKERS:
+        save_variants(
+            recipe_id, name, render_variants(settings.MEDIA_ROOT, name)
+        )
+        return None
+
+    def done(future):
+        try:
+            save_variants(recipe_id, name, future.result())
+        except Exception:
+            logger.exception('Не удалось обработать картинку %s', name)
+        finally:
+            connection.close()
+
+    future = get_executor().submit(
+        render_variants, settings.MEDIA_ROOT, name
+    )
+    future.add_done_callback(done)
+    return future
@@ -1,9 +1,21 @@
+import math
+
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import (Exists, F, OuterRef, Prefetch, Sum, Value,
+                              Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.dispatch import Signal
+from django.utils import timezone
+
+from users.constant import FEED_FANOUT_LIMIT
+from users.models import Subscribe
 
-from .constant import LENTH_COLOR, MAX_LENGTH
+from .constant import (LENTH_COLOR, MAX_LENGTH, TRENDING_HALF_LIFE,
+                       TRENDING_MIN_SCORE)
 
 User = get_user_model()
 
@@ -61,6 +73,51 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Запросы к рецептам с флагами текущего пользователя."""
+
+    def with_user_flags(self, user):
+        """Вычисляет is_favorited, is_in_shopping_cart и is_subscribed
+        автора одним запросом на страницу вместо запроса на каждый рецепт.
+        """
+        authors = User.objects.all()
+        if user.is_authenticated:
+            authors = authors.annotate(is_subscribed=Exists(
+                Subscribe.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+            return self.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+            ).prefetch_related(Prefetch('author', queryset=authors))
+        return self.annotate(
+            is_favorited=Value(False, output_field=models.BooleanField()),
+            is_in_shopping_cart=Value(
+                False, output_field=models.BooleanField()
+            ),
+        ).select_related('author')
+
+    def first_per_author(self, limit):
+        """Оставляет не более limit последних рецептов каждого автора.
+
+        Нумерация строк выполняется оконной функцией ROW_NUMBER() внутри
+        подзапроса, поэтому выборка для всех авторов занимает один запрос.
+        """
+        ranked = self.annotate(author_row=Window(
+            expression=RowNumber(),
+            partition_by=F('author'),
+            order_by=F('id').desc(),
+        )).values('id', 'author_row')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) AS ranked WHERE author_row <= %s',
+            (*params, limit)
+        ))
+
+
 class Recipe(models.Model):
     """Модель рецептов."""
 
@@ -96,10 +153,52 @@ class Recipe(models.Model):
         verbose_name='Теги',
         related_name='recipes'
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество в избранном',
+        default=0,
+        editable=False
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='Количество в списках покупок',
+        default=0,
+        editable=False
+    )
+    similar_stale = models.BooleanField(
+        verbose_name='Похожие рецепты устарели',
+        default=False,
+        editable=False
+    )
+    created = models.DateTimeField(
+        verbose_name='Дата публикации',
+        auto_now_add=True
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                fields=('-favorites_count', '-id'),
+                name='recipe_popularity_idx'
+            ),
+            models.Index(
+                fields=('author', '-id'),
+                name='recipe_author_feed_idx'
+            ),
+            models.Index(
+                fields=('id', ),
+                condition=models.Q(similar_stale=True),
+                name='recipe_similar_stale_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -152,6 +251,195 @@ class TagInRecipe(models.Model):
         return self.tag.name
 
 
+# Рецепты добавлены в избранное или список покупок пользователя или
+# удалены оттуда: sender — модель связи, аргументы user_id, recipe_ids
+# и using. Отправляются один раз на вызов add и remove, а для строк,
+# сохраненных или удаленных через ORM, — из post_save и post_delete.
+user_recipes_added = Signal()
+user_recipes_removed = Signal()
+
+
+class UserRecipeQuerySet(models.QuerySet):
+    """Запросы к связям пользователя с рецептами (избранное, покупки).
+
+    Добавление и удаление выполняются одним запросом INSERT ... ON CONFLICT
+    DO NOTHING / DELETE ... RETURNING, поэтому повторные и одновременные
+    запросы не приводят к ошибке уникальности. Для фактически измененных
+    строк отправляется один сигнал user_recipes_added или
+    user_recipes_removed со списком рецептов.
+    """
+
+    def _execute(self, sql, params, recipe_ids):
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        sql = sql.format(
+            table=connection.ops.quote_name(self.model._meta.db_table),
+            recipes=connection.ops.quote_name(Recipe._meta.db_table),
+            ids=', '.join(['%s'] * len(recipe_ids)),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, (*params, *recipe_ids))
+            return using, cursor.fetchall()
+
+    def add(self, user, recipe_ids):
+        """Добавляет существующие рецепты из recipe_ids и возвращает
+        созданные записи."""
+        now = timezone.now()
+        using, rows = self._execute(
+            'INSERT INTO {table} (user_id, recipe_id, created) '
+            'SELECT %s, id, %s FROM {recipes} WHERE id IN ({ids}) '
+            'ON CONFLICT DO NOTHING RETURNING id, recipe_id',
+            (user.pk, now), recipe_ids
+        )
+        created = [
+            self.model(pk=pk, user=user, recipe_id=recipe_id, created=now)
+            for pk, recipe_id in rows
+        ]
+        if created:
+            user_recipes_added.send(
+                sender=self.model, user_id=user.pk,
+                recipe_ids=[obj.recipe_id for obj in created], using=using
+            )
+        return created
+
+    def remove(self, user, recipe_ids):
+        """Удаляет рецепты из recipe_ids и возвращает удаленные записи."""
+        using, rows = self._execute(
+            'DELETE FROM {table} WHERE user_id = %s AND recipe_id IN ({ids}) '
+            'RETURNING id, recipe_id',
+            (user.pk, ), recipe_ids
+        )
+        deleted = [
+            self.model(pk=pk, user=user, recipe_id=recipe_id)
+            for pk, recipe_id in rows
+        ]
+        if deleted:
+            user_recipes_removed.send(
+                sender=self.model, user_id=user.pk,
+                recipe_ids=[obj.recipe_id for obj in deleted], using=using
+            )
+        return deleted
+
+
+class ShoppingListQuerySet(models.QuerySet):
+    """Поддержка суммарных списков покупок в актуальном состоянии.
+
+    Изменения корзины и ингредиентов рецептов применяются к строкам
+    списка как приращения количества и числа рецептов, в которых
+    встречается ингредиент. Строки, у которых не осталось рецептов,
+    удаляются.
+    """
+
+    def _execute(self, sql, params):
+        connection = connections[router.db_for_write(self.model)]
+        quote_name = connection.ops.quote_name
+        sql = sql.format(
+            table=quote_name(self.model._meta.db_table),
+            ingredients=quote_name(IngredientInRecipe._meta.db_table),
+            cart=quote_name(ShoppingCart._meta.db_table),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def add_recipes(self, user_id, recipe_ids):
+        """Прибавляет ингредиенты рецептов к списку пользователя."""
+        ids = ', '.join(['%s'] * len(recipe_ids))
+        self._execute(
+            'INSERT INTO {table} (user_id, ingredient_id, amount, '
+            'recipes_count) '
+            'SELECT %s, ingredient_id, COALESCE(SUM(amount), 0), COUNT(*) '
+            f'FROM {{ingredients}} WHERE recipe_id IN ({ids}) '
+            'GROUP BY ingredient_id '
+            'ON CONFLICT (user_id, ingredient_id) DO UPDATE SET '
+            'amount = {table}.amount + EXCLUDED.amount, '
+            'recipes_count = {table}.recipes_count + EXCLUDED.recipes_count',
+            (user_id, *recipe_ids)
+        )
+
+    def remove_recipes(self, user_id, recipe_ids):
+        """Вычитает ингредиенты рецептов из списка пользователя."""
+        ids = ', '.join(['%s'] * len(recipe_ids))
+        recipe_ingredients = (
+            'FROM {ingredients} AS item '
+            f'WHERE item.recipe_id IN ({ids}) '
+            'AND item.ingredient_id = {table}.ingredient_id'
+        )
+        self._execute(
+            'UPDATE {table} SET '
+            'amount = amount - COALESCE('
+            f'(SELECT SUM(item.amount) {recipe_ingredients}), 0), '
+            'recipes_count = recipes_count - '
+            f'(SELECT COUNT(*) {recipe_ingredients}) '
+            'WHERE user_id = %s AND ingredient_id IN '
+            f'(SELECT ingredient_id FROM {{ingredients}} '
+            f'WHERE recipe_id IN ({ids}))',
+            (*recipe_ids, *recipe_ids, user_id, *recipe_ids)
+        )
+        self._execute(
+            'DELETE FROM {table} WHERE user_id = %s AND recipes_count <= 0',
+            (user_id, )
+        )
+
+    def apply_recipe_changes(self, recipe_id, before, after):
+        """Переносит изменение ингредиентов рецепта в списки всех, у кого
+        он лежит в корзине.
+
+        before и after сопоставляют id ингредиента с количеством до
+        и после изменения.
+        """
+        changes = []
+        for ingredient_id in before.keys() | after.keys():
+            amount = (after.get(ingredient_id) or 0) - (
+                before.get(ingredient_id) or 0
+            )
+            recipes_count = (
+                (ingredient_id in after) - (ingredient_id in before)
+            )
+            if amount or recipes_count:
+                changes.append((ingredient_id, amount, recipes_count))
+        if not changes:
+            return
+        rows = ' UNION ALL '.join(
+            ['SELECT %s AS ingredient_id, %s AS amount, '
+             '%s AS recipes_count'] * len(changes)
+        )
+        self._execute(
+            'INSERT INTO {table} (user_id, ingredient_id, amount, '
+            'recipes_count) '
+            'SELECT cart.user_id, changes.ingredient_id, changes.amount, '
+            'changes.recipes_count '
+            f'FROM {{cart}} AS cart, ({rows}) AS changes '
+            'WHERE cart.recipe_id = %s '
+            'ON CONFLICT (user_id, ingredient_id) DO UPDATE SET '
+            'amount = {table}.amount + EXCLUDED.amount, '
+            'recipes_count = {table}.recipes_count + EXCLUDED.recipes_count',
+            (*[value for change in changes for value in change], recipe_id)
+        )
+        self._execute(
+            'DELETE FROM {table} WHERE recipes_count <= 0 AND user_id IN '
+            '(SELECT user_id FROM {cart} WHERE recipe_id = %s)',
+            (recipe_id, )
+        )
+
+    def rebuild(self, user_ids):
+        """Пересчитывает списки пользователей по их корзинам."""
+        ids = ', '.join(['%s'] * len(user_ids))
+        self._execute(
+            f'DELETE FROM {{table}} WHERE user_id IN ({ids})', user_ids
+        )
+        self._execute(
+            'INSERT INTO {table} (user_id, ingredient_id, amount, '
+            'recipes_count) '
+            'SELECT cart.user_id, item.ingredient_id, '
+            'COALESCE(SUM(item.amount), 0), COUNT(*) '
+            'FROM {cart} AS cart '
+            'JOIN {ingredients} AS item ON item.recipe_id = cart.recipe_id '
+            f'WHERE cart.user_id IN ({ids}) '
+            'GROUP BY cart.user_id, item.ingredient_id',
+            user_ids
+        )
+
+
 class Favorite(models.Model):
     """Модель для отображения избранного."""
 
@@ -166,6 +454,12 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True
+    )
+
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Избранное'
@@ -176,6 +470,16 @@ class Favorite(models.Model):
                 name='unique_favourite'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('user', 'recipe'),
+                name='favorite_user_recipe_idx'
+            ),
+            models.Index(
+                fields=('created', ),
+                name='favorite_created_idx'
+            ),
+        )
 
     def __str__(self):
         return f'{self.user} добавил {self.recipe} в избранное'
@@ -195,6 +499,12 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True
+    )
+
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -205,6 +515,326 @@ class ShoppingCart(models.Model):
                 name='unique_shopping_cart'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('user', 'recipe'),
+                name='shopping_cart_user_recipe_idx'
+            ),
+            models.Index(
+                fields=('created', ),
+                name='shopping_cart_created_idx'
+            ),
+        )
 
     def __str__(self):
         return f'{self.user} добавил {self.recipe} в список покупок'
+
+
+class ShoppingListItem(models.Model):
+    """Модель суммарного списка покупок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(
+        verbose_name='Количество',
+        default=0
+    )
+    recipes_count = models.IntegerField(
+        verbose_name='Количество рецептов',
+        default=0
+    )
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списка покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount}'
+
+
+class FeedItemQuerySet(models.QuerySet):
+    """Ленты подписок: рецепты авторов раскладываются по лентам
+    подписчиков при публикации.
+
+    Рецепты авторов, у которых больше FEED_FANOUT_LIMIT подписчиков,
+    в ленты не копируются и дочитываются из таблицы рецептов при чтении.
+    """
+
+    def _backfill(self, where, params):
+        connection = connections[router.db_for_write(self.model)]
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote_name(self.model._meta.db_table)} '
+                '(user_id, recipe_id, author_id) '
+                'SELECT follow.user_id, recipe.id, recipe.author_id '
+                f'FROM {quote_name(Subscribe._meta.db_table)} AS follow '
+                f'JOIN {quote_name(Recipe._meta.db_table)} AS recipe '
+                'ON recipe.author_id = follow.author_id '
+                f'WHERE {where} AND follow.author_id IN '
+                f'(SELECT id FROM {quote_name(User._meta.db_table)} '
+                'WHERE followers_count <= %s) '
+                'ON CONFLICT DO NOTHING',
+                (*params, FEED_FANOUT_LIMIT)
+            )
+
+    def publish(self, recipe_id):
+        """Добавляет новый рецепт в ленты подписчиков автора."""
+        self._backfill('recipe.id = %s', (recipe_id, ))
+
+    def follow(self, user_id, author_id):
+        """Добавляет в ленту пользователя рецепты нового автора."""
+        self._backfill(
+            'follow.user_id = %s AND follow.author_id = %s',
+            (user_id, author_id)
+        )
+
+    def fan_out_author(self, author_id):
+        """Раскладывает все рецепты автора по лентам его подписчиков."""
+        self._backfill('follow.author_id = %s', (author_id, ))
+
+    def rebuild(self, user_ids):
+        """Пересобирает ленты пользователей по их подпискам."""
+        ids = ', '.join(['%s'] * len(user_ids))
+        self.filter(user_id__in=user_ids).delete()
+        self._backfill(f'follow.user_id IN ({ids})', user_ids)
+
+    def recipe_ids(self, user, before, limit):
+        """Возвращает id не больше limit рецептов ленты, меньших before,
+        по убыванию.
+
+        Строки ленты и рецепты каждого дочитываемого автора выбираются
+        отдельными ветками UNION ALL, каждая по своему индексу и со своим
+        LIMIT, поэтому рецепты подписок целиком не сортируются.
+        """
+        connection = connections[router.db_for_read(self.model)]
+        quote_name = connection.ops.quote_name
+        pulled = list(Subscribe.objects.filter(
+            user=user, author__followers_count__gt=FEED_FANOUT_LIMIT
+        ).order_by().values_list('author_id', flat=True))
+        bound, bound_params = '', ()
+        if before is not None:
+            bound, bound_params = ' AND {column} < %s', (before, )
+        branches = [(
+            'SELECT recipe_id AS id FROM '
+            f'{quote_name(self.model._meta.db_table)} WHERE user_id = %s'
+            + bound.format(column='recipe_id')
+            + ' ORDER BY recipe_id DESC LIMIT %s',
+            (user.pk, *bound_params, limit)
+        )]
+        branches.extend((
+            f'SELECT id FROM {quote_name(Recipe._meta.db_table)} '
+            'WHERE author_id = %s' + bound.format(column='id')
+            + ' ORDER BY id DESC LIMIT %s',
+            (author_id, *bound_params, limit)
+        ) for author_id in pulled)
+        sql = ' UNION ALL '.join(
+            f'SELECT id FROM ({branch}) AS branch{number}'
+            for number, (branch, _) in enumerate(branches)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id FROM ({sql}) AS timeline '
+                'GROUP BY id ORDER BY id DESC LIMIT %s',
+                (*[value for _, params in branches for value in params],
+                 limit)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class FeedItem(models.Model):
+    """Модель строки ленты подписок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор рецепта',
+    )
+
+    objects = FeedItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Строка ленты подписок'
+        verbose_name_plural = 'Строки ленты подписок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_item'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+
+class SimilarRecipeQuerySet(models.QuerySet):
+    """Похожие рецепты, посчитанные по совместному добавлению
+    в избранное."""
+
+    def similar_ids(self, recipe_id, limit):
+        return list(self.filter(recipe_id=recipe_id).order_by(
+            '-score'
+        ).values_list('similar_id', flat=True)[:limit])
+
+    def recommended_ids(self, user, limit):
+        """Рецепты, похожие на избранное пользователя, кроме уже
+        добавленных, по убыванию суммы сходства."""
+        return list(self.filter(
+            recipe__favorites__user=user
+        ).filter(~Exists(Favorite.objects.filter(
+            user=user, recipe=OuterRef('similar')
+        ))).values('similar').annotate(
+            total=Sum('score')
+        ).order_by('-total', '-similar').values_list(
+            'similar', flat=True
+        )[:limit])
+
+    def trim(self, recipe_ids, limit):
+        """Оставляет у рецептов не больше limit самых похожих."""
+        ranked = self.filter(recipe_id__in=recipe_ids).annotate(
+            similar_row=Window(
+                expression=RowNumber(),
+                partition_by=F('recipe'),
+                order_by=(F('score').desc(), F('similar').desc()),
+            )
+        ).values('id', 'similar_row')
+        sql, params = ranked.query.sql_with_params()
+        self.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) AS ranked WHERE similar_row > %s',
+            (*params, limit)
+        )).delete()
+
+
+class SimilarRecipe(models.Model):
+    """Модель похожего рецепта."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar',
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    objects = SimilarRecipeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_similar_recipe'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('recipe', '-score'),
+                name='similar_recipe_score_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.similar} похож на {self.recipe}'
+
+
+class TrendingRecipeQuerySet(models.QuerySet):
+    """Популярность рецептов с экспоненциальным затуханием.
+
+    Вклад добавления в избранное или список покупок уменьшается вдвое
+    за TRENDING_HALF_LIFE секунд. Хранится двоичный логарифм суммы
+    вкладов, приведенных к началу эпохи Unix: log2(Σ 2^(t / T)). Порядок
+    по нему совпадает с порядком по текущей популярности, поэтому новые
+    события меняют только строки своих рецептов.
+    """
+
+    def ranked_ids(self):
+        return self.order_by('-score', '-recipe').values_list(
+            'recipe_id', flat=True
+        )
+
+    def prune(self, now):
+        """Удаляет рецепты, популярность которых упала ниже
+        TRENDING_MIN_SCORE: если у рецепта появятся новые события, их
+        сумма начнется заново, без этого остатка."""
+        self.filter(score__lt=(
+            now.timestamp() / TRENDING_HALF_LIFE
+            + math.log2(TRENDING_MIN_SCORE)
+        )).delete()
+
+
+class TrendingRecipe(models.Model):
+    """Модель популярности рецепта."""
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trending',
+        verbose_name='Рецепт',
+    )
+    score = models.FloatField(verbose_name='Популярность')
+
+    objects = TrendingRecipeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Популярный рецепт'
+        verbose_name_plural = 'Популярные рецепты'
+        indexes = (
+            models.Index(
+                fields=('-score', '-recipe'),
+                name='trending_recipe_score_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} ({self.score})'
+
+
+class TrendingCheckpoint(models.Model):
+    """Модель отметки, до которой учтены события популярности."""
+
+    scored_until = models.DateTimeField(verbose_name='События учтены до')
+
+    class Meta:
+        verbose_name = 'Отметка расчета популярности'
+        verbose_name_plural = 'Отметки расчета популярности'
+
+    def __str__(self):
+        return f'События учтены до {self.scored_until}'
@@ -0,0 +1,88 @@
+import numpy as np
+from scipy import sparse
+
+
+class CoFavorites:
+    """Разреженная матрица избранного «рецепты × пользователи».
+
+    Сходство двух рецептов — косинус между множествами добавивших их
+    в избранное: число общих пользователей, деленное на корень из
+    произведения размеров множеств. Совместные добавления считаются
+    произведением строк матрицы на транспонированную матрицу блоками
+    рецептов, размер блока ограничен числом пар в произведении.
+    """
+
+    def __init__(self, recipe_ids, user_ids):
+        # id рецептов и пользователей служат номерами строк и столбцов:
+        # они плотные, а пустые строки в CSR стоят одно смещение.
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int32)
+        user_ids = np.asarray(user_ids, dtype=np.int32)
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(recipe_ids), dtype=np.int32),
+             (recipe_ids, user_ids)),
+            shape=(
+                recipe_ids.max(initial=0) + 1, user_ids.max(initial=0) + 1
+            )
+        )
+        self.matrix.sum_duplicates()
+        self.matrix.data[:] = 1
+        self.transposed = self.matrix.T.tocsr()
+        self.sizes = np.diff(self.matrix.indptr)
+        # Верхняя граница числа пар в строке произведения: сумма
+        # размеров избранного всех пользователей, добавивших рецепт.
+        self.pairs = self.matrix @ np.diff(self.transposed.indptr).astype(
+            np.int64
+        )
+
+    def contains(self, recipe_ids):
+        """Маска рецептов, которые хоть кто-то добавил в избранное."""
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        found = recipe_ids < len(self.sizes)
+        found[found] = self.sizes[recipe_ids[found]] > 0
+        return found
+
+    def positions(self, recipe_ids):
+        """Номера строк рецептов; рецепты без избранного пропускаются."""
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        return recipe_ids[self.contains(recipe_ids)]
+
+    def users(self, recipe_id):
+        """id пользователей, добавивших рецепт в избранное."""
+        if recipe_id >= len(self.sizes):
+            return np.zeros(0, dtype=np.int32)
+        indptr = self.matrix.indptr
+        return self.matrix.indices[indptr[recipe_id]:indptr[recipe_id + 1]]
+
+    def blocks(self, positions, max_pairs):
+        """Делит строки на блоки не больше max_pairs пар в произведении
+        (рецепт, у которого пар больше, образует блок один)."""
+        start, total = 0, 0
+        for end, pairs in enumerate(self.pairs[positions].tolist()):
+            if end > start and total + pairs > max_pairs:
+                yield positions[start:end]
+                start, total = end, 0
+            total += pairs
+        if start < len(positions):
+            yield positions[start:]
+
+    def similar(self, positions):
+        """Возвращает все пары (рецепт блока, похожий рецепт, сходство),
+        отсортированные по рецепту и убыванию сходства."""
+        common = (self.matrix[positions] @ self.transposed).tocsr()
+        rows = np.repeat(positions, np.diff(common.indptr))
+        columns = common.indices
+        other = rows != columns
+        rows, columns = rows[other], columns[other]
+        scores = common.data[other] / np.sqrt(
+            self.sizes[rows].astype(np.float64) * self.sizes[columns]
+        )
+        order = np.lexsort((-columns, -scores, rows))
+        return rows[order], columns[order], scores[order]
+
+
+def first_per_recipe(recipe_ids, limit):
+    """Маска первых limit пар каждого рецепта в отсортированных парах."""
+    starts = np.flatnonzero(np.r_[True, recipe_ids[1:] != recipe_ids[:-1]])
+    counts = np.diff(np.r_[starts, len(recipe_ids)])
+    ranks = np.arange(len(recipe_ids)) - np.repeat(starts, counts)
+    return ranks < limit
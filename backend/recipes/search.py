@@ -0,0 +1,421 @@
+import re
+from bisect import bisect_left
+from threading import local
+
+import numpy as np
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Value
+from django.db.models.expressions import RawSQL
+
+TRIGRAM_INDEX_SQL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+    'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_prefix '
+    'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)',
+)
+
+
+RECIPE_SEARCH_SQL = {
+    'postgresql': (
+        'CREATE TABLE IF NOT EXISTS recipes_recipe_search ('
+        'recipe_id integer PRIMARY KEY, document tsvector NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_search_document '
+        'ON recipes_recipe_search USING gin (document)',
+    ),
+    'sqlite': (
+        'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_search '
+        'USING fts5(name, ingredients, text, '
+        "tokenize='unicode61 remove_diacritics 2')",
+    ),
+}
+RECIPE_SOURCE_SQL = (
+    'SELECT recipe.id, recipe.name, recipe.text, ('
+    "SELECT COALESCE({names}, '') FROM recipes_ingredientinrecipe AS item "
+    'JOIN recipes_ingredient AS ingredient '
+    'ON ingredient.id = item.ingredient_id '
+    'WHERE item.recipe_id = recipe.id) AS ingredients '
+    'FROM recipes_recipe AS recipe WHERE {where}'
+)
+RECIPE_INSERT_SQL = {
+    'postgresql': (
+        'INSERT INTO recipes_recipe_search (recipe_id, document) '
+        'SELECT id, '
+        "setweight(to_tsvector('russian', name) "
+        "|| to_tsvector('english', name), 'A') "
+        "|| setweight(to_tsvector('russian', ingredients) "
+        "|| to_tsvector('english', ingredients), 'B') "
+        "|| setweight(to_tsvector('russian', text) "
+        "|| to_tsvector('english', text), 'C') "
+        'FROM ({source}) AS recipe'
+    ),
+    'sqlite': (
+        'INSERT INTO recipes_recipe_search (rowid, name, ingredients, text) '
+        'SELECT id, name, ingredients, text FROM ({source}) AS recipe'
+    ),
+}
+RECIPE_NAMES_SQL = {
+    'postgresql': "string_agg(ingredient.name, ' ')",
+    'sqlite': "group_concat(ingredient.name, ' ')",
+}
+RECIPE_ID_COLUMN = {'postgresql': 'recipe_id', 'sqlite': 'rowid'}
+RECIPE_QUERY_SQL = (
+    "(websearch_to_tsquery('russian', %s) "
+    "|| websearch_to_tsquery('english', %s))"
+)
+FTS_COLUMN_WEIGHTS = (10.0, 4.0, 1.0)
+# Разные доли m / n с n до 1000 отличаются больше чем на 1e-6, а ошибка
+# суммирования m слагаемых 1 / n на много порядков меньше допуска.
+COVERAGE_TOLERANCE = 1e-9
+
+_pending = local()
+
+
+def create_search_indexes(using):
+    """Создает индексы для поиска ингредиентов в PostgreSQL.
+
+    Выражение UPPER(name::text) совпадает с тем, что Django подставляет
+    для lookup-ов icontains и istartswith, поэтому планировщик использует
+    триграммный индекс для подстрок и text_pattern_ops для префиксов.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for sql in TRIGRAM_INDEX_SQL:
+            cursor.execute(sql)
+
+
+def create_recipe_search(using):
+    """Создает поисковую таблицу рецептов и дополняет ее недостающими
+    рецептами.
+
+    В PostgreSQL это tsvector с GIN-индексом по названию, ингредиентам
+    и описанию в русской и английской конфигурациях, в SQLite —
+    виртуальная таблица FTS5. Внешнего ключа у таблицы нет, чтобы
+    очистка таблиц Django не упиралась в нее: строки удаленных рецептов
+    убирает сигнал post_delete.
+    """
+    connection = connections[using]
+    if connection.vendor not in RECIPE_SEARCH_SQL:
+        return
+    id_column = RECIPE_ID_COLUMN[connection.vendor]
+    with connection.cursor() as cursor:
+        for sql in RECIPE_SEARCH_SQL[connection.vendor]:
+            cursor.execute(sql)
+        cursor.execute(
+            f'DELETE FROM recipes_recipe_search WHERE {id_column} '
+            'NOT IN (SELECT id FROM recipes_recipe)'
+        )
+    index_recipes(
+        connection,
+        f'recipe.id NOT IN (SELECT {id_column} FROM recipes_recipe_search)'
+    )
+
+
+def index_recipes(connection, where, params=()):
+    source = RECIPE_SOURCE_SQL.format(
+        names=RECIPE_NAMES_SQL[connection.vendor], where=where
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            RECIPE_INSERT_SQL[connection.vendor].format(source=source),
+            params
+        )
+
+
+def refresh_recipe_search(recipe_ids, using=DEFAULT_DB_ALIAS):
+    """Пересобирает поисковые документы рецептов по текущим данным."""
+    connection = connections[using]
+    if connection.vendor not in RECIPE_SEARCH_SQL or not recipe_ids:
+        return
+    recipe_ids = list(recipe_ids)
+    ids = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM recipes_recipe_search '
+            f'WHERE {RECIPE_ID_COLUMN[connection.vendor]} IN ({ids})',
+            recipe_ids
+        )
+    index_recipes(connection, f'recipe.id IN ({ids})', recipe_ids)
+
+
+def rebuild_recipe_search(using=DEFAULT_DB_ALIAS):
+    """Пересобирает поисковую таблицу целиком."""
+    create_recipe_search(using)
+    connection = connections[using]
+    if connection.vendor not in RECIPE_SEARCH_SQL:
+        return
+    with transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM recipes_recipe_search')
+        index_recipes(connection, '1 = 1')
+
+
+def schedule_recipe_search_refresh(recipe_ids, using=DEFAULT_DB_ALIAS):
+    """Откладывает пересборку документов до фиксации транзакции, когда
+    ингредиенты рецепта уже сохранены."""
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids = {}
+    _pending.recipe_ids.setdefault(using, set()).update(recipe_ids)
+    transaction.on_commit(lambda: flush_recipe_search(using), using=using)
+
+
+def flush_recipe_search(using):
+    recipe_ids = _pending.recipe_ids.pop(using, None)
+    if recipe_ids:
+        refresh_recipe_search(recipe_ids, using)
+
+
+def search_recipes(queryset, value):
+    """Оставляет рецепты, подходящие под запрос, и добавляет к ним
+    релевантность search_rank."""
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        params = (value, value)
+        matches = RawSQL(
+            'SELECT recipe_id FROM recipes_recipe_search '
+            f'WHERE document @@ {RECIPE_QUERY_SQL}', params
+        )
+        rank = RawSQL(
+            f'SELECT ts_rank(document, {RECIPE_QUERY_SQL}) '
+            'FROM recipes_recipe_search '
+            'WHERE recipe_id = recipes_recipe.id', params
+        )
+    else:
+        words = re.findall(r'\w+', value)
+        if not words:
+            return queryset.annotate(search_rank=Value(0.0)).none()
+        match = ' '.join(f'"{word}"*' for word in words)
+        matches = RawSQL(
+            'SELECT rowid FROM recipes_recipe_search '
+            'WHERE recipes_recipe_search MATCH %s', (match, )
+        )
+        weights = ', '.join(map(str, FTS_COLUMN_WEIGHTS))
+        rank = RawSQL(
+            f'SELECT -bm25(recipes_recipe_search, {weights}) '
+            'FROM recipes_recipe_search '
+            'WHERE recipes_recipe_search MATCH %s '
+            'AND rowid = recipes_recipe.id', (match, )
+        )
+    return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+
+class IngredientNameIndex:
+    """Отсортированный префиксный индекс названий ингредиентов в памяти.
+
+    Используется вместо индексов PostgreSQL, когда база данных их не
+    поддерживает (SQLite). Префиксные совпадения находятся бинарным
+    поиском и образуют непрерывный отрезок отсортированного списка.
+    """
+
+    def __init__(self, entries):
+        entries = sorted((name.casefold(), pk) for pk, name in entries)
+        self._keys = [key for key, _ in entries]
+        self._ids = [pk for _, pk in entries]
+
+    def search(self, value):
+        """Возвращает id совпадений: сначала префиксные, затем остальные.
+
+        Вторым элементом возвращается количество префиксных совпадений.
+        """
+        keys, ids = self._keys, self._ids
+        value = value.casefold()
+        start = bisect_left(keys, value)
+        end = bisect_left(keys, value + chr(0x10FFFF), start)
+        prefix_ids = ids[start:end]
+        substring_ids = [
+            pk for position, (key, pk) in enumerate(zip(keys, ids))
+            if value in key and not start <= position < end
+        ]
+        return prefix_ids + substring_ids, len(prefix_ids)
+
+
+class RecipeMatches:
+    """Рецепты, в которых есть хотя бы один из доступных ингредиентов.
+
+    Ведет себя как последовательность id рецептов, отсортированных по доле
+    доступных ингредиентов, затем по убыванию id. Срез перебирает уровни
+    доли сверху вниз, пока не наберет нужное число рецептов, поэтому
+    первые страницы не требуют сортировки всех совпадений.
+    """
+
+    def __init__(self, coverage):
+        self.coverage = coverage
+        self.count = np.count_nonzero(coverage)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, page):
+        start, stop, _ = page.indices(self.count)
+        if start >= stop:
+            return []
+        coverage = self.coverage.copy()
+        levels, found = [], 0
+        while found < stop:
+            level = coverage.max()
+            recipe_ids = np.flatnonzero(
+                coverage >= level - COVERAGE_TOLERANCE
+            )
+            coverage[recipe_ids] = 0
+            levels.append(recipe_ids[::-1])
+            found += len(recipe_ids)
+        return np.concatenate(levels)[start:stop].tolist()
+
+
+class RecipeIngredientIndex:
+    """Инвертированный индекс ингредиентов рецептов в памяти.
+
+    Для каждого ингредиента хранится множество его рецептов: у редких —
+    отсортированный массив id, у частых (соль, лук) — битовая маска
+    по id рецепта, которая меньше массива и раскрывается за один проход.
+    Для каждого рецепта хранится вес 1 / число его ингредиентов. Доля
+    доступных ингредиентов всех рецептов — сумма масок и массивов
+    доступных ингредиентов, умноженная на веса.
+
+    Состав рецептов на момент построения хранится в виде CSR (смещения
+    по id рецепта и общий массив ингредиентов), измененные позже рецепты —
+    в словаре поверх него. Так обновление трогает только множества тех
+    ингредиентов, которые рецепт потерял или приобрел.
+    """
+
+    def __init__(self, recipe_ids, ingredient_ids):
+        order = np.lexsort((ingredient_ids, recipe_ids))
+        recipe_ids = recipe_ids[order].astype(np.int32)
+        self.ingredients = ingredient_ids[order].astype(np.int32)
+        sizes = np.bincount(recipe_ids)
+        self.offsets = np.concatenate(([0], np.cumsum(sizes)))
+        self.changed = {}
+        weights = np.zeros(len(sizes))
+        np.divide(1, sizes, out=weights, where=sizes > 0)
+        self.state = (
+            {
+                ingredient_id: self.compact(recipes, len(weights))
+                for ingredient_id, recipes in self.group(
+                    recipe_ids, self.ingredients
+                ).items()
+            },
+            weights,
+        )
+
+    @staticmethod
+    def group(recipe_ids, ingredient_ids):
+        order = np.lexsort((recipe_ids, ingredient_ids))
+        recipe_ids = recipe_ids[order].astype(np.int32)
+        ingredient_ids = ingredient_ids[order]
+        bounds = np.flatnonzero(np.diff(ingredient_ids)) + 1
+        return {
+            int(ingredient_ids[start]): recipes
+            for start, recipes in zip(
+                np.r_[0, bounds], np.split(recipe_ids, bounds)
+            ) if len(recipes)
+        }
+
+    @staticmethod
+    def compact(recipe_ids, size):
+        """Хранит множество рецептов маской, если она меньше массива."""
+        if len(recipe_ids) * 32 <= size:
+            return recipe_ids
+        mask = np.zeros(size, dtype=np.uint8)
+        mask[recipe_ids] = 1
+        return np.packbits(mask)
+
+    @staticmethod
+    def merge(recipes, stale, fresh):
+        """Удаляет и вставляет id рецептов в отсортированный массив."""
+        positions = np.searchsorted(recipes, stale)
+        found = positions < len(recipes)
+        found[found] = recipes[positions[found]] == stale[found]
+        recipes = np.delete(recipes, positions[found])
+        fresh = np.sort(fresh)
+        return np.insert(recipes, np.searchsorted(recipes, fresh), fresh)
+
+    @staticmethod
+    def toggle(mask, size, stale, fresh):
+        """Снимает и ставит биты рецептов в копии упакованной маски."""
+        mask = np.concatenate((
+            mask, np.zeros((size + 7) // 8 - len(mask), dtype=np.uint8)
+        ))
+        bits = (128 >> (stale & 7)).astype(np.uint8)
+        np.bitwise_and.at(mask, stale >> 3, ~bits)
+        bits = (128 >> (fresh & 7)).astype(np.uint8)
+        np.bitwise_or.at(mask, fresh >> 3, bits)
+        return mask
+
+    @staticmethod
+    def is_mask(recipes):
+        return recipes.dtype == np.uint8
+
+    def recipe_ingredients(self, recipe_id):
+        if recipe_id in self.changed:
+            return self.changed[recipe_id]
+        if recipe_id + 1 < len(self.offsets):
+            return self.ingredients[
+                self.offsets[recipe_id]:self.offsets[recipe_id + 1]
+            ]
+        return self.ingredients[:0]
+
+    def update(self, changed_ids, recipe_ids, ingredient_ids):
+        """Заменяет ингредиенты рецептов changed_ids текущими парами.
+
+        Измененные множества собираются заново и подменяют состояние
+        целиком, поэтому параллельные запросы читают согласованный снимок.
+        """
+        sets, weights = self.state
+        current = {
+            recipe_id: self.ingredients[:0] for recipe_id in changed_ids
+        }
+        current.update(
+            (recipe_id, np.unique(ingredient_ids[recipe_ids == recipe_id]))
+            for recipe_id in np.unique(recipe_ids).tolist()
+        )
+        removed, added = {}, {}
+        for recipe_id, ingredients in current.items():
+            previous = self.recipe_ingredients(recipe_id)
+            for ingredient_id in np.setdiff1d(
+                previous, ingredients, assume_unique=True
+            ).tolist():
+                removed.setdefault(ingredient_id, []).append(recipe_id)
+            for ingredient_id in np.setdiff1d(
+                ingredients, previous, assume_unique=True
+            ).tolist():
+                added.setdefault(ingredient_id, []).append(recipe_id)
+            self.changed[recipe_id] = ingredients
+        size = max(len(weights), max(current, default=-1) + 1)
+        sets = dict(sets)
+        for ingredient_id in removed.keys() | added.keys():
+            stale = np.array(removed.get(ingredient_id, []), dtype=np.int32)
+            fresh = np.array(added.get(ingredient_id, []), dtype=np.int32)
+            recipes = sets.get(ingredient_id, stale[:0])
+            if self.is_mask(recipes):
+                recipes = self.toggle(recipes, size, stale, fresh)
+            else:
+                recipes = self.compact(
+                    self.merge(recipes, stale, fresh), size
+                )
+            if len(recipes):
+                sets[ingredient_id] = recipes
+            else:
+                sets.pop(ingredient_id, None)
+        weights = np.concatenate((weights, np.zeros(size - len(weights))))
+        for recipe_id, ingredients in current.items():
+            weights[recipe_id] = len(ingredients) and 1 / len(ingredients)
+        self.state = (sets, weights)
+
+    def match(self, ingredient_ids):
+        """Считает долю доступных ингредиентов для всех рецептов.
+
+        Счетчики однобайтовые: ингредиентов в запросе меньше 256.
+        """
+        sets, weights = self.state
+        counts = np.zeros(len(weights), dtype=np.uint8)
+        for ingredient_id in set(ingredient_ids):
+            recipes = sets.get(ingredient_id)
+            if recipes is None:
+                continue
+            if self.is_mask(recipes):
+                counts += np.unpackbits(recipes, count=len(counts))
+            else:
+                counts[recipes] += 1
+        return RecipeMatches(counts * weights)
@@ -0,0 +1,178 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from users.constant import FEED_FANOUT_LIMIT
+from users.models import Subscribe
+
+from .images import delete_variants, process_image
+from .models import (Favorite, FeedItem, Ingredient, IngredientInRecipe,
+                     Recipe, ShoppingCart, ShoppingListItem, User,
+                     user_recipes_added, user_recipes_removed)
+from .search import (create_recipe_search, create_search_indexes,
+                     schedule_recipe_search_refresh)
+
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'shopping_cart_count',
+}
+
+
+@receiver(post_migrate)
+def create_ingredient_search_indexes(sender, using, **kwargs):
+    if sender.name == 'recipes':
+        create_search_indexes(using)
+        create_recipe_search(using)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def user_recipe_saved(sender, instance, created, using, **kwargs):
+    if created:
+        user_recipes_added.send(
+            sender=sender, user_id=instance.user_id,
+            recipe_ids=(instance.recipe_id, ), using=using
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def user_recipe_deleted(sender, instance, using, **kwargs):
+    user_recipes_removed.send(
+        sender=sender, user_id=instance.user_id,
+        recipe_ids=(instance.recipe_id, ), using=using
+    )
+
+
+@receiver(user_recipes_added, sender=Favorite)
+@receiver(user_recipes_added, sender=ShoppingCart)
+def increment_recipe_counters(sender, recipe_ids, **kwargs):
+    counter = RECIPE_COUNTERS[sender]
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        **{counter: F(counter) + 1}
+    )
+
+
+@receiver(user_recipes_removed, sender=Favorite)
+@receiver(user_recipes_removed, sender=ShoppingCart)
+def decrement_recipe_counters(sender, recipe_ids, **kwargs):
+    counter = RECIPE_COUNTERS[sender]
+    Recipe.objects.filter(
+        pk__in=recipe_ids, **{f'{counter}__gt': 0}
+    ).update(**{counter: F(counter) - 1})
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_image_processing(sender, instance, **kwargs):
+    name = instance.image.name
+    if name and instance.image_variants.get('source') != name:
+        transaction.on_commit(lambda: process_image(instance.pk, name))
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_image_variants(sender, instance, **kwargs):
+    variants = instance.image_variants
+    transaction.on_commit(lambda: delete_variants(variants))
+
+
+@receiver(user_recipes_added, sender=ShoppingCart)
+def add_to_shopping_list(sender, user_id, recipe_ids, **kwargs):
+    ShoppingListItem.objects.add_recipes(user_id, recipe_ids)
+
+
+@receiver(user_recipes_removed, sender=ShoppingCart)
+def remove_from_shopping_list(sender, user_id, recipe_ids, **kwargs):
+    ShoppingListItem.objects.remove_recipes(user_id, recipe_ids)
+
+
+@receiver(pre_save, sender=IngredientInRecipe)
+def remember_ingredient_in_recipe(sender, instance, **kwargs):
+    instance.saved_state = None
+    if instance.pk is not None:
+        instance.saved_state = IngredientInRecipe.objects.filter(
+            pk=instance.pk
+        ).values('recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+def update_shopping_lists(sender, instance, **kwargs):
+    before = {}
+    saved = getattr(instance, 'saved_state', None)
+    if saved is not None:
+        before = {saved['ingredient_id']: saved['amount']}
+        if saved['recipe_id'] != instance.recipe_id:
+            ShoppingListItem.objects.apply_recipe_changes(
+                saved['recipe_id'], before, {}
+            )
+            before = {}
+    ShoppingListItem.objects.apply_recipe_changes(
+        instance.recipe_id, before, {instance.ingredient_id: instance.amount}
+    )
+
+
+@receiver(post_delete, sender=IngredientInRecipe)
+def remove_from_shopping_lists(sender, instance, **kwargs):
+    ShoppingListItem.objects.apply_recipe_changes(
+        instance.recipe_id, {instance.ingredient_id: instance.amount}, {}
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def refresh_recipe_search(sender, instance, using, **kwargs):
+    schedule_recipe_search_refresh((instance.pk, ), using)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def refresh_recipe_search_ingredients(sender, instance, using, **kwargs):
+    schedule_recipe_search_refresh((instance.recipe_id, ), using)
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_recipes_search(sender, instance, created, using,
+                                      **kwargs):
+    if not created:
+        schedule_recipe_search_refresh(
+            instance.recipes.values_list('id', flat=True), using
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def publish_to_feeds(sender, instance, created, **kwargs):
+    if created:
+        FeedItem.objects.publish(instance.pk)
+
+
+@receiver(post_save, sender=Subscribe)
+def follow_author(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            followers_count=F('followers_count') + 1
+        )
+        FeedItem.objects.follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscribe)
+def unfollow_author(sender, instance, **kwargs):
+    authors = User.objects.filter(pk=instance.author_id)
+    authors.filter(followers_count__gt=0).update(
+        followers_count=F('followers_count') - 1
+    )
+    FeedItem.objects.filter(
+        user_id=instance.user_id, author_id=instance.author_id
+    ).delete()
+    # Автор снова стал обычным: его рецепты больше не дочитываются
+    # при чтении, поэтому их нужно разложить по лентам.
+    if authors.filter(followers_count=FEED_FANOUT_LIMIT).exists():
+        FeedItem.objects.fan_out_author(instance.author_id)
+
+
+@receiver(user_recipes_added, sender=Favorite)
+@receiver(user_recipes_removed, sender=Favorite)
+def mark_similar_recipes_stale(sender, recipe_ids, **kwargs):
+    Recipe.objects.filter(
+        pk__in=recipe_ids, similar_stale=False
+    ).update(similar_stale=True)
@@ -0,0 +1,24 @@
+import numpy as np
+
+from .constant import TRENDING_HALF_LIFE
+
+
+def event_scores(recipe_ids, timestamps):
+    """Складывает вклады событий по рецептам.
+
+    Возвращает id рецептов и двоичные логарифмы сумм вкладов в том же
+    виде, что хранится в TrendingRecipe.score.
+    """
+    if not len(recipe_ids):
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    order = np.argsort(recipe_ids, kind='stable')
+    recipe_ids = recipe_ids[order]
+    exponents = timestamps[order] / TRENDING_HALF_LIFE
+    starts = np.flatnonzero(np.r_[True, recipe_ids[1:] != recipe_ids[:-1]])
+    # Показатели степени порядка 2 * 10^4, поэтому сумма считается
+    # относительно наибольшего показателя рецепта.
+    peaks = np.maximum.reduceat(exponents, starts)
+    sums = np.add.reduceat(np.exp2(
+        exponents - np.repeat(peaks, np.diff(np.r_[starts, len(exponents)]))
+    ), starts)
+    return recipe_ids[starts], peaks + np.log2(sums)
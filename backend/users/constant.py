@@ -1,2 +1,3 @@
 LENGTH_EMAIL = 254
 LENGTH_USER = 150
+FEED_FANOUT_LIMIT = 1000
@@ -1,7 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
-from .constant import LENGTH_EMAIL, LENGTH_USER
+from .constant import FEED_FANOUT_LIMIT, LENGTH_EMAIL, LENGTH_USER
 
 
 class CustomUser(AbstractUser):
@@ -22,11 +22,23 @@ class CustomUser(AbstractUser):
         verbose_name='Фамилия',
         max_length=LENGTH_USER,
     )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
         ordering = ('username',)
+        indexes = (
+            models.Index(
+                fields=('id', ),
+                condition=models.Q(followers_count__gt=FEED_FANOUT_LIMIT),
+                name='user_popular_author_idx'
+            ),
+        )
 
     def __str__(self):
         return self.username
@@ -47,6 +59,10 @@ class Subscribe(models.Model):
         verbose_name='Автор рецепта',
         related_name='following',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата подписки',
+        auto_now_add=True
+    )
 
     class Meta:
         constraints = (